@@ -0,0 +1,249 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Inference routes behind admission control
+ADMISSION_ENDPOINTS = [
+    path for path in os.environ.get(
+        "DERMO_ADMISSION_ENDPOINTS", "/predict,/diagnose_skin,/analyze,/predict/batch,/diagnose_skin/batch"
+    ).split(",") if path
+]
+# Per endpoint: requests handled at once, and requests allowed to wait behind them (0 = unbounded)
+MAX_CONCURRENT = int(os.environ.get("DERMO_MAX_CONCURRENT", 32))
+MAX_QUEUE = int(os.environ.get("DERMO_MAX_QUEUE", 64))
+# A queued request that still has no slot after this long is rejected
+QUEUE_TIMEOUT = float(os.environ.get("DERMO_QUEUE_TIMEOUT", 10))
+RETRY_AFTER = int(os.environ.get("DERMO_RETRY_AFTER", 1))
+# Per-client token bucket: sustained requests/second and burst size (0 disables)
+RATE_LIMIT = float(os.environ.get("DERMO_RATE_LIMIT", 0))
+RATE_BURST = int(os.environ.get("DERMO_RATE_BURST", 20))
+RATE_LIMIT_CLIENTS = int(os.environ.get("DERMO_RATE_LIMIT_CLIENTS", 10_000))
+# Use the first X-Forwarded-For hop as the client (only behind a proxy that sets it)
+TRUST_FORWARDED = os.environ.get("DERMO_TRUST_FORWARDED", "0") == "1"
+# Degraded mode (no live LLM calls) above this many queued requests or this p95 latency (0 disables either)
+DEGRADE_QUEUE_DEPTH = int(os.environ.get("DERMO_DEGRADE_QUEUE_DEPTH", 32))
+DEGRADE_LATENCY_MS = float(os.environ.get("DERMO_DEGRADE_LATENCY_MS", 0))
+# Stay degraded until the triggers have been clear for this long
+DEGRADE_COOLDOWN = float(os.environ.get("DERMO_DEGRADE_COOLDOWN", 10))
+
+
+class Rejected(Exception):
+    def __init__(self, status, detail, retry_after):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Gate:
+    """
+    Concurrency limit with a bounded wait queue for one endpoint
+    Args:
+        limit: Requests handled at once
+        queue_size: Requests allowed to wait for a slot (0 = unbounded)
+        timeout: Seconds a queued request waits before it is rejected
+    """
+
+    def __init__(self, limit=MAX_CONCURRENT, queue_size=MAX_QUEUE, timeout=QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        # Decide and count before the first await, so a burst arriving in one tick sees every earlier arrival
+        if self.queue_size and self.active + self.waiting >= self.limit + self.queue_size:
+            self.rejected += 1
+            raise Rejected(503, "Server is at capacity, retry shortly", RETRY_AFTER)
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending
+            await self._semaphore.acquire()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise Rejected(503, "Timed out waiting for capacity, retry shortly", RETRY_AFTER)
+            finally:
+                self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {"limit": self.limit, "queue_size": self.queue_size, "active": self.active,
+                "waiting": self.waiting, "rejected": self.rejected}
+
+
+class TokenBuckets:
+    """
+    Per-client token buckets; the least recently seen clients are forgotten beyond max_clients
+    """
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, max_clients=RATE_LIMIT_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._buckets = OrderedDict()
+
+    def take(self, client):
+        """
+        Returns:
+            0 if the request may proceed, otherwise seconds until the client has a token again
+        """
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            wait = 0.0
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.rejected += 1
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class Degradation:
+    """
+    Turns on when queued requests or recent p95 latency cross their thresholds, and off again
+    once both have stayed below them for the cooldown
+    Args:
+        depth: Callable returning the current number of queued requests
+        queue_depth: Depth threshold (0 disables)
+        latency_ms: p95 latency threshold over recent requests (0 disables)
+        cooldown: Seconds the triggers must be clear before leaving degraded mode
+    """
+
+    def __init__(self, depth, queue_depth=DEGRADE_QUEUE_DEPTH, latency_ms=DEGRADE_LATENCY_MS, cooldown=DEGRADE_COOLDOWN):
+        self.depth = depth
+        self.queue_depth = queue_depth
+        self.latency_ms = latency_ms
+        self.cooldown = cooldown
+        self.active = False
+        self.activations = 0
+        self._latencies = deque(maxlen=200)
+        self._p95_ms = 0.0
+        self._checked = 0.0
+        self._clear_since = None
+
+    def observe(self, seconds):
+        self._latencies.append(seconds * 1000)
+
+    def check(self):
+        now = time.monotonic()
+        # The p95 is recomputed at most a few times per second
+        if self.latency_ms and self._latencies and now - self._checked > 0.25:
+            self._p95_ms = float(np.percentile(self._latencies, 95))
+            self._checked = now
+        triggered = (self.queue_depth and self.depth() >= self.queue_depth) or (self.latency_ms and self._p95_ms >= self.latency_ms)
+        if triggered:
+            if not self.active:
+                self.activations += 1
+            self.active = True
+            self._clear_since = None
+        elif self.active:
+            if self._clear_since is None:
+                self._clear_since = now
+            elif now - self._clear_since >= self.cooldown:
+                self.active = False
+        return self.active
+
+    def stats(self):
+        return {"active": self.active, "activations": self.activations, "queue_depth": self.depth(),
+                "p95_ms": round(self._p95_ms, 1)}
+
+
+class Admission:
+    """
+    Admission control for the inference endpoints: rate limit, then bounded queue, then degraded-mode bookkeeping
+    Args:
+        extra_depth: Callable returning queued work outside the gates (e.g. batcher queues)
+    """
+
+    def __init__(self, endpoints=ADMISSION_ENDPOINTS, extra_depth=lambda: 0):
+        self.gates = {path: Gate() for path in endpoints}
+        self.rate_limiter = TokenBuckets() if RATE_LIMIT > 0 else None
+        self.degradation = Degradation(lambda: sum(gate.waiting for gate in self.gates.values()) + extra_depth())
+
+    @property
+    def degraded(self):
+        return self.degradation.check()
+
+    def stats(self):
+        return {
+            "endpoints": {path: gate.stats() for path, gate in self.gates.items()},
+            "rate_limited": self.rate_limiter.rejected if self.rate_limiter else None,
+            "degraded": self.degradation.stats(),
+        }
+
+
+def _client_key(scope):
+    if TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+async def _reject(send, rejection):
+    body = json.dumps({"detail": rejection.detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": rejection.status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(rejection.retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an Admission to its endpoints; rejected requests never reach the app
+    """
+
+    def __init__(self, app, admission):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        gate = self.admission.gates.get(scope["path"]) if scope["type"] == "http" else None
+        if gate is None:
+            return await self.app(scope, receive, send)
+        limiter = self.admission.rate_limiter
+        if limiter is not None:
+            wait = limiter.take(_client_key(scope))
+            if wait:
+                return await _reject(send, Rejected(429, "Too many requests", wait))
+        # Sample the triggers on arrival, while the queues are at their deepest
+        self.admission.degradation.check()
+        try:
+            await gate.acquire()
+        except Rejected as rejection:
+            return await _reject(send, rejection)
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+            self.admission.degradation.observe(time.monotonic() - start)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from groq import FALLBACK_ADVICE, get_medical_advice, stream_medical_advice
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+ADVICE_STORE_PATH = os.environ.get("DERMO_ADVICE_STORE", os.path.join(current_dir, "advice_store.json"))
+# Advice older than this is served as-is but refreshed in the background
+ADVICE_TTL = float(os.environ.get("DERMO_ADVICE_TTL", 7 * 24 * 3600))
+ADVICE_REFRESH_INTERVAL = float(os.environ.get("DERMO_ADVICE_REFRESH_INTERVAL", 600))
+
+logger = logging.getLogger(__name__)
+
+
+class AdviceStore:
+    """
+    In-memory advice per diagnosis class, persisted to a JSON file
+    Args:
+        path: JSON file the store is warmed from and written back to
+        ttl: Seconds before an entry is considered stale
+        fetch: Coroutine function returning advice text for a class name
+        stream_fetch: Async generator function yielding the advice for a class name as deltas
+    """
+
+    def __init__(self, path=ADVICE_STORE_PATH, ttl=ADVICE_TTL, fetch=get_medical_advice,
+                 stream_fetch=stream_medical_advice):
+        self.path = path
+        self.ttl = ttl
+        self.fetch = fetch
+        self.stream_fetch = stream_fetch
+        self._entries = {}
+        self._inflight = {}
+        self.classes = []
+        self._refresher = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not read advice store %s: %r", self.path, exc)
+            self._entries = {}
+        return len(self._entries)
+
+    def save(self):
+        # Write-then-rename so other workers never read a half-written file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_stale(self, diagnosis):
+        entry = self._entries.get(diagnosis)
+        return entry is None or time.time() - entry["fetched_at"] > self.ttl
+
+    def cached(self, diagnosis):
+        entry = self._entries.get(diagnosis)
+        return entry["advice"] if entry else None
+
+    async def get(self, diagnosis):
+        """
+        Advice for a class; only a class never fetched before waits on the LLM
+        """
+        advice = self.cached(diagnosis)
+        if advice is not None:
+            if self.is_stale(diagnosis):
+                self.refresh(diagnosis)
+            return advice
+        return await asyncio.shield(self.refresh(diagnosis))
+
+    def refresh(self, diagnosis):
+        """
+        Start (or join) the upstream fetch for a class and return its task
+        """
+        task = self._inflight.get(diagnosis)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(diagnosis))
+            self._inflight[diagnosis] = task
+            task.add_done_callback(lambda _: self._inflight.pop(diagnosis, None))
+        return task
+
+    async def stream(self, diagnosis):
+        """
+        Advice for a class as deltas, sharing one upstream call between concurrent misses
+        The first caller relays the LLM stream as it arrives; the others join its fetch and get
+        the finished text in one piece. Only a complete answer is stored
+        Raises IncompleteAdvice (to the first caller) if the answer was cut short
+        """
+        task = self._inflight.get(diagnosis)
+        if task is not None:
+            yield await asyncio.shield(task)
+            return
+        result = asyncio.get_running_loop().create_future()
+        self._inflight[diagnosis] = result
+        result.add_done_callback(lambda _: self._inflight.pop(diagnosis, None))
+        advice = None
+        try:
+            chunks = []
+            async for delta in self.stream_fetch(diagnosis):
+                chunks.append(delta)
+                yield delta
+            advice = "".join(chunks).strip()
+            if advice != FALLBACK_ADVICE:
+                await self.put(diagnosis, advice)
+        finally:
+            # Also on IncompleteAdvice or a client that went away: never leave the joiners waiting
+            if not result.done():
+                result.set_result(advice or self.cached(diagnosis) or FALLBACK_ADVICE)
+
+    async def _fetch_and_store(self, diagnosis):
+        advice = await self.fetch(diagnosis)
+        # Never persist the fallback; the next request should try again
+        if advice == FALLBACK_ADVICE:
+            return self.cached(diagnosis) or advice
+        await self.put(diagnosis, advice)
+        return advice
+
+    async def put(self, diagnosis, advice):
+        """
+        Record advice obtained elsewhere (e.g. a streamed completion) and persist it
+        """
+        self._entries[diagnosis] = {"advice": advice, "fetched_at": time.time()}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.save)
+        except OSError as exc:
+            logger.warning("Could not write advice store %s: %r", self.path, exc)
+
+    async def _refresh_loop(self, interval):
+        while True:
+            stale = [name for name in self.classes if self.is_stale(name)]
+            if stale:
+                await asyncio.gather(*(self.refresh(name) for name in stale), return_exceptions=True)
+            await asyncio.sleep(interval)
+
+    def start(self, classes, interval=ADVICE_REFRESH_INTERVAL):
+        """
+        Fill missing classes and keep refreshing stale ones in the background
+        """
+        self.classes = list(classes)
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.ensure_future(self._refresh_loop(interval))
+
+    def set_classes(self, classes):
+        """
+        Switch the classes kept warm (e.g. after a model swap changed them); new ones are fetched right away
+        """
+        self.classes = list(classes)
+        for name in self.classes:
+            if self.cached(name) is None:
+                self.refresh(name)
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    def stats(self):
+        return {
+            "classes": len(self._entries),
+            "stale": sum(1 for name in self._entries if self.is_stale(name)),
+            "inflight": len(self._inflight),
+        }
@@ -1,16 +1,38 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import Depends, FastAPI, File, Header, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import torch
-from PIL import Image
+import asyncio
+import hmac
 import io
+import json
+import logging
 import os
-from torchvision import transforms
-from mole_model.evaluate_model import ISICModel
-from skin_diagnosis.model import ViTClassifier, vi_processor
-from groq import get_medical_advice
+import pickle
+import zipfile
+from functools import partial
+from typing import List, Optional
+from model_registry import ModelRegistry
+from backends import warmup
+import groq
+from imaging import ImageTooLarge, decode_image
+from advice_store import AdviceStore
+from batching import batch_buckets
+import executors
+import metrics
+from cpu_plan import plan_worker
+from admission import Admission, AdmissionMiddleware
+from result_cache import ResultCache, content_digest
+from tta import mole_uncertain, skin_uncertain
 import torch.nn.functional as F
 
-app = FastAPI()
+app = FastAPI(default_response_class=metrics.TimedJSONResponse)
+logger = logging.getLogger(__name__)
+
+# Bounded per-endpoint queues, per-client rate limit and degraded mode; inside CORS so rejections keep their headers
+admission = Admission(extra_depth=lambda: mole_registry.current.batcher.queue_depth() + skin_registry.current.batcher.queue_depth())
+app.add_middleware(AdmissionMiddleware, admission=admission)
 
 # Configure CORS
 app.add_middleware(
@@ -25,44 +47,80 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-stage latency, in-flight and error metrics (served at /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.exception_handler(ImageTooLarge)
+async def image_too_large(request, exc):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
 
 # Set up device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# Threads/affinity for this worker process, before any model work starts the thread pools
+cpu_plan = plan_worker()
 
-# Define transformations
-transform = transforms.Compose([
-    transforms.Resize((256, 256)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.4815, 0.4578, 0.4082],
-        std=[0.2686, 0.2613, 0.2758]
-    )
-])
-
-# Load the model
+# Load the model (bundle if present, otherwise the legacy checkpoint; never the network)
+# and serve it through the configured backend (DERMO_BACKEND / DERMO_QUANTIZE).
+# The registry can swap in new weights later without a restart
 current_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(current_dir, 'mole_model', 'final_isic_model.pt')
-model = ISICModel('edgenext_base.in21k_ft_in1k', num_classes=1, pretrained=False)
-model.load_state_dict(torch.load(model_path, map_location=device))
-model = model.to(device)
-model.eval()
+mole_bundle_paths = [
+    os.environ.get("DERMO_MOLE_BUNDLE"),
+    os.path.join(current_dir, 'mole_model', 'isic_bundle.safetensors'),
+    os.path.join(current_dir, 'mole_model', 'isic_bundle.pt'),
+]
+mole_registry = ModelRegistry(
+    "isic", mole_bundle_paths, model_path, device, torch.sigmoid,
+    onnx_path=os.environ.get("DERMO_MOLE_ONNX", os.path.join(current_dir, 'mole_model', 'isic.onnx')),
+    int8_path=os.environ.get("DERMO_MOLE_INT8", os.path.join(current_dir, 'mole_model', 'isic_int8.pt')),
+)
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    # Read the image file
-    contents = await file.read()
-    image = Image.open(io.BytesIO(contents)).convert('RGB')
-    
-    # Apply transformations
-    image_tensor = transform(image).unsqueeze(0).to(device)
-    
-    # Make prediction
-    with torch.no_grad():
-        outputs = model(image_tensor)
-        probability = torch.sigmoid(outputs).cpu().numpy()[0][0]
-    
+# Results keyed by upload hash + model version, so re-uploads skip decode and inference
+result_cache = ResultCache()
+
+def once(make):
+    # Start make() on first use only, so a first pass and a TTA pass share one decode
+    started = []
+    def get():
+        if not started:
+            started.append(asyncio.ensure_future(make()))
+        return started[0]
+    return get
+
+async def mole_probability(mole, digest, preprocess, tta=False):
+    """
+    Args:
+        tta: Run the augmented views straight away; otherwise they only run when DERMO_TTA=auto and the
+            first pass lands in the uncertainty band
+    Returns:
+        (probability, whether it came from the augmented views)
+    """
+    preprocess = once(preprocess)
+    if not tta:
+        async def compute():
+            # Pinned on its own: a shielded compute can outlive the request that started it
+            with mole.use():
+                # Make prediction (batched with any other pending uploads)
+                return (await mole.batcher.submit(await preprocess()))[0].item()
+        probability = await result_cache.get_or_compute(f"{digest}:isic:{mole.version}", compute)
+        if not mole_uncertain(probability):
+            return probability, False
+
+    async def compute_tta():
+        tensor = await preprocess()
+        with mole.use(), metrics.stage("tta", "isic"):
+            return (await executors.run_inference(mole.forward_tta, tensor))[0].item()
+    return await result_cache.get_or_compute(f"{digest}:isic-tta:{mole.version}", compute_tta), True
+
+def preprocess_mole(mole, contents):
+    with metrics.stage("decode", "isic"):
+        image = decode_image(contents, mole.size)
+    with metrics.stage("preprocess", "isic"):
+        return mole.preprocessor(image)
+
+def mole_predictions(probability, version, tta=False):
     # Create prediction dictionary
-    predictions = {
+    return {
         'ailment': 'Cancer' if probability > 0.5 else 'Benign',
         'positive': float(probability),
         'recommendations': [
@@ -73,83 +131,452 @@ async def predict(file: UploadFile = File(...)):
             'Continue regular skin monitoring.',
             'Use sun protection and practice skin safety.',
             'Schedule routine skin check-ups with your healthcare provider.'
-        ]
+        ],
+        'tta': tta,
+        'model_version': version
     }
-    
-    return predictions
+
+@app.post("/predict")
+async def predict(file: UploadFile = File(...), tta: bool = False):
+    # Read the image file
+    with metrics.stage("read"):
+        contents = await file.read()
+
+    digest = await executors.run_decode(content_digest, contents)
+
+    # Decode, transform and predict unless these exact bytes were seen before
+    with mole_registry.current.use() as mole:
+        probability, used_tta = await mole_probability(mole, digest, lambda: executors.run_decode(preprocess_mole, mole, contents), tta)
+
+    return mole_predictions(probability, mole.version, used_tta)
 
 # Path to your best_model.pth from training
 skin_diagnosis_weights_path = os.path.join(current_dir, 'skin_diagnosis', 'best_model.pth')
+skin_bundle_paths = [
+    os.environ.get("DERMO_SKIN_BUNDLE"),
+    os.path.join(current_dir, 'skin_diagnosis', 'vit_bundle.safetensors'),
+    os.path.join(current_dir, 'skin_diagnosis', 'vit_bundle.pt'),
+]
 
-# Example class_to_idx from training (adjust to your real classes):
-class_to_idx = {
-    'Acne': 0,
-    'Actinic_Keratosis': 1,
-    'Benign_tumors': 2,
-    'Bullous': 3,
-    'Candidiasis': 4,
-    'DrugEruption': 5,
-    'Eczema': 6,
-    'Infestations_Bites': 7,
-    'Lichen': 8,
-    'Lupus': 9,
-    'Moles': 10,
-    'Psoriasis': 11,
-    'Rosacea': 12,
-    'Seborrh_Keratoses': 13,
-    'SkinCancer': 14,
-    'Sun_Sunlight_Damage': 15,
-    'Tinea': 16,
-    'Unknown_Normal': 17,
-    'Vascular_Tumors': 18,
-    'Vasculitis': 19,
-    'Vitiligo': 20,
-    'Warts': 21
-}
-idx_to_class = {v: k for k, v in class_to_idx.items()}
-NUM_CLASSES = len(class_to_idx)
+def skin_swapped(old, new):
+    # A swapped bundle may add, drop or reorder diagnoses
+    if new.classes != old.classes:
+        class_to_idx.clear()
+        class_to_idx.update({name: idx for idx, name in enumerate(new.classes)})
+        advice_store.set_classes(class_to_idx)
 
 # Instantiate the classifier
-skin_diagnosis_model = ViTClassifier(NUM_CLASSES)
-skin_diagnosis_model.load_state_dict(
-    torch.load(skin_diagnosis_weights_path, map_location=device),
-    strict=False
+skin_registry = ModelRegistry(
+    "vit", skin_bundle_paths, skin_diagnosis_weights_path, device, partial(F.softmax, dim=1),
+    onnx_path=os.environ.get("DERMO_SKIN_ONNX", os.path.join(current_dir, 'skin_diagnosis', 'vit.onnx')),
+    int8_path=os.environ.get("DERMO_SKIN_INT8", os.path.join(current_dir, 'skin_diagnosis', 'vit_int8.pt')),
+    on_swap=skin_swapped,
 )
-skin_diagnosis_model = skin_diagnosis_model.to(device)
-skin_diagnosis_model.eval()
+
+class_to_idx = {name: idx for idx, name in enumerate(skin_registry.current.classes)}
+
+# Advice only depends on the predicted class, so it is served from memory
+advice_store = AdviceStore()
+
+def preprocess_skin(skin, contents):
+    with metrics.stage("decode", "vit"):
+        image = decode_image(contents, skin.size)
+    with metrics.stage("preprocess", "vit"):
+        return skin.preprocessor(image)
+
+def preprocess_both(mole, skin, contents):
+    # One decode feeds both the 256x256 ISIC tensor and the 224x224 ViT tensor
+    with metrics.stage("decode", "both"):
+        image = decode_image(contents, max(mole.size, skin.size))
+    with metrics.stage("preprocess", "both"):
+        return mole.preprocessor(image), skin.preprocessor(image)
+
+
+def skin_prediction(skin, output):
+    # Early-exit models also report the encoder layer the image stopped at (None for a distilled CNN student)
+    probs, exit_layer = output if isinstance(output, tuple) else (output, skin.bundle["config"].get("num_hidden_layers"))
+    pred_idx = probs.argmax().item()
+    return skin.classes[pred_idx], probs[pred_idx].item(), exit_layer
+
+
+async def skin_classification(skin, digest, preprocess, tta=False):
+    """
+    Args:
+        tta: Run the augmented views straight away; otherwise they only run when DERMO_TTA=auto and the
+            first pass is not confident enough
+    Returns:
+        (class, confidence, exit layer, whether it came from the augmented views)
+    """
+    preprocess = once(preprocess)
+    if not tta:
+        async def compute():
+            # Pinned on its own: a shielded compute can outlive the request that started it
+            with skin.use():
+                # Make prediction (batched with any other pending uploads)
+                return skin_prediction(skin, await skin.batcher.submit(await preprocess()))
+        # Results carry the exit layer, so they are keyed apart from the older (class, confidence) entries
+        pred_class, confidence, exit_layer = await result_cache.get_or_compute(f"{digest}:vit-exit:{skin.version}", compute)
+        if not skin_uncertain(confidence):
+            return pred_class, confidence, exit_layer, False
+
+    async def compute_tta():
+        tensor = await preprocess()
+        with skin.use(), metrics.stage("tta", "vit"):
+            return skin_prediction(skin, await executors.run_inference(skin.forward_tta, tensor))
+    return (*await result_cache.get_or_compute(f"{digest}:vit-tta:{skin.version}", compute_tta), True)
+
+
+async def advice_for(pred_class):
+    # Under overload the classification must not wait on the LLM: serve whatever advice is at hand
+    if admission.degraded:
+        return advice_store.cached(pred_class) or groq.FALLBACK_ADVICE
+    return await advice_store.get(pred_class)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_diagnosis(pred_class, confidence, exit_layer, tta, version):
+    # Phase one: the classification is available right away
+    yield sse_event("diagnosis", {"prediction": pred_class, "confidence": confidence, "exit_layer": exit_layer,
+                                  "tta": tta, "model_version": version})
+
+    # Phase two: advice sections as they are parsed
+    parser = groq.SectionStreamParser()
+    advice = advice_store.cached(pred_class)
+    if advice is None and admission.degraded:
+        advice = groq.FALLBACK_ADVICE
+    complete = True
+    if advice is not None:
+        for section, text in parser.feed(advice):
+            yield sse_event("advice", {"section": section, "text": text})
+    else:
+        chunks = []
+        try:
+            async for delta in advice_store.stream(pred_class):
+                chunks.append(delta)
+                for section, text in parser.feed(delta):
+                    yield sse_event("advice", {"section": section, "text": text})
+            advice = "".join(chunks).strip()
+        except groq.IncompleteAdvice:
+            # The sections sent so far are cut short; do not pass them off as the full answer
+            complete = False
+            advice = groq.FALLBACK_ADVICE
+    yield sse_event("done", {"advice": advice, "complete": complete})
 
 
 @app.post("/diagnose_skin")
-async def predict(file: UploadFile = File(...)):
+async def predict(file: UploadFile = File(...), stream: bool = False, tta: bool = False):
     # Read the image file
-    contents = await file.read()
-    image = Image.open(io.BytesIO(contents)).convert('RGB')
-
-    # Preprocess with vi_processor for multi-class
-    pixel_values = vi_processor(image, return_tensors="pt")["pixel_values"]
+    with metrics.stage("read"):
+        contents = await file.read()
+    digest = await executors.run_decode(content_digest, contents)
 
-    # Make prediction
-    with torch.no_grad():
-        outputs = skin_diagnosis_model(pixel_values.to(device))
-        probs = F.softmax(outputs, dim=1)
-        pred_idx = probs.argmax(dim=1).item()
-        confidence = probs[0, pred_idx].item()
+    # Decode, preprocess and classify unless these exact bytes were seen before
+    with skin_registry.current.use() as skin:
+        pred_class, confidence, exit_layer, used_tta = await skin_classification(
+            skin, digest, lambda: executors.run_decode(preprocess_skin, skin, contents), tta
+        )
 
-    # Get predicted class index
-    pred_idx = outputs.argmax(dim=1).item()
-    pred_class = idx_to_class[pred_idx]
+    # Send the diagnosis immediately and stream the advice behind it
+    if stream:
+        return StreamingResponse(
+            stream_diagnosis(pred_class, confidence, exit_layer, used_tta, skin.version),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
 
-    # For example, get advice from an LLM or a local mapdsfds fds
-    response = get_medical_advice(pred_class)['choices'][0]['message']['content']
+    # Get advice for the class (only the first request for a class waits on the LLM)
+    response = await advice_for(pred_class)
 
     # Return as a dict (JSON)
     return {
       "prediction": pred_class,
       "advice": response,
-      "confidence": confidence
+      "confidence": confidence,
+      "exit_layer": exit_layer,
+      "tta": used_tta,
+      "model_version": skin.version
+    }
+
+
+@app.post("/analyze")
+async def analyze(file: UploadFile = File(...), tta: bool = False):
+    # One upload and one decode for both models
+    with metrics.stage("read"):
+        contents = await file.read()
+    digest = await executors.run_decode(content_digest, contents)
+    decoded = []
+
+    with mole_registry.current.use() as mole, skin_registry.current.use() as skin:
+        def decode_both():
+            # Shared by both models, and skipped entirely when both results are cached
+            if not decoded:
+                decoded.append(asyncio.ensure_future(executors.run_decode(preprocess_both, mole, skin, contents)))
+            return decoded[0]
+
+        async def mole_tensor():
+            return (await decode_both())[0]
+
+        async def pixel_values():
+            return (await decode_both())[1]
+
+        # EdgeNeXt and ViT forwards run side by side in the inference pool
+        (probability, mole_tta), (pred_class, confidence, exit_layer, skin_tta) = await asyncio.gather(
+            mole_probability(mole, digest, mole_tensor, tta),
+            skin_classification(skin, digest, pixel_values, tta),
+        )
+
+    return {
+        "mole": mole_predictions(probability, mole.version, mole_tta),
+        "skin": {
+            "prediction": pred_class,
+            "advice": await advice_for(pred_class),
+            "confidence": confidence,
+            "exit_layer": exit_layer,
+            "tta": skin_tta,
+            "model_version": skin.version
+        }
+    }
+
+
+# Multi-image uploads (clinic sessions)
+BATCH_CHUNK_SIZE = int(os.environ.get("DERMO_BATCH_CHUNK_SIZE", 16))
+BATCH_MAX_IMAGES = int(os.environ.get("DERMO_BATCH_MAX_IMAGES", 128))
+BATCH_MAX_ZIP_BYTES = int(os.environ.get("DERMO_BATCH_MAX_ZIP_BYTES", 512 * 1024 * 1024))
+# Batches larger than this stream NDJSON results as each chunk finishes
+BATCH_STREAM_THRESHOLD = int(os.environ.get("DERMO_BATCH_STREAM_THRESHOLD", 32))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def unpack_zip(contents):
+    with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            and not os.path.basename(info.filename).startswith('.')
+        ]
+        if sum(info.file_size for info in members) > BATCH_MAX_ZIP_BYTES:
+            raise HTTPException(status_code=413, detail="Zip archive is too large")
+        if len(members) > BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+        return [(info.filename, archive.read(info)) for info in members]
+
+
+async def read_uploads(files):
+    items = []
+    for upload in files:
+        with metrics.stage("read"):
+            contents = await upload.read()
+        if zipfile.is_zipfile(io.BytesIO(contents)):
+            try:
+                items.extend(await executors.run_decode(unpack_zip, contents))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Could not read zip archive {upload.filename}")
+        else:
+            items.append((upload.filename, contents))
+        if len(items) > BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in upload")
+    return items
+
+
+async def run_batch(items, registry, preprocess, make_result):
+    """
+    Decode every image in parallel, then run the forwards chunk by chunk on one model version
+    The version is pinned when iteration starts, so a streamed response that is never sent holds nothing
+    Yields one result per image, in upload order
+    """
+    with registry.current.use() as serving:
+        async for result in _run_batch(items, serving, preprocess, make_result):
+            yield result
+
+
+async def _run_batch(items, serving, preprocess, make_result):
+    model = serving.kind
+    decodes = [asyncio.ensure_future(executors.run_decode(preprocess, serving, contents)) for _, contents in items]
+    try:
+        for start in range(0, len(items), BATCH_CHUNK_SIZE):
+            chunk = list(range(start, min(start + BATCH_CHUNK_SIZE, len(items))))
+            tensors = await asyncio.gather(*(decodes[i] for i in chunk), return_exceptions=True)
+            valid = [i for i, tensor in zip(chunk, tensors) if not isinstance(tensor, Exception)]
+            outputs = {}
+            if valid:
+                batch = torch.stack([tensors[i - start] for i in valid])
+                metrics.BATCH_SIZE.labels(model).observe(len(valid))
+                with metrics.stage("forward", model):
+                    outputs = dict(zip(valid, await executors.run_inference(serving.forward, batch)))
+            for i in chunk:
+                result = {"index": i, "filename": items[i][0]}
+                if i in outputs:
+                    result.update(await make_result(serving, outputs[i]))
+                else:
+                    result["error"] = "Could not decode image"
+                    metrics.ERRORS.labels(metrics.endpoint.get(), "decode").inc()
+                yield result
+    finally:
+        for task in decodes:
+            task.cancel()
+
+
+async def batch_response(items, results):
+    if len(items) > BATCH_STREAM_THRESHOLD:
+        async def ndjson():
+            async for result in results:
+                yield json.dumps(result) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    return {"results": [result async for result in results]}
+
+
+async def mole_batch_result(mole, probs):
+    return mole_predictions(probs[0].item(), mole.version)
+
+
+async def skin_batch_result(skin, probs):
+    pred_class, confidence, exit_layer = skin_prediction(skin, probs)
+    return {
+        "prediction": pred_class,
+        "advice": await advice_for(pred_class),
+        "confidence": confidence,
+        "exit_layer": exit_layer,
+        "model_version": skin.version
+    }
+
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    items = await read_uploads(files)
+    return await batch_response(items, run_batch(items, mole_registry, preprocess_mole, mole_batch_result))
+
+
+@app.post("/diagnose_skin/batch")
+async def diagnose_skin_batch(files: List[UploadFile] = File(...)):
+    items = await read_uploads(files)
+    return await batch_response(items, run_batch(items, skin_registry, preprocess_skin, skin_batch_result))
+
+
+@app.get("/batch_stats")
+async def batch_stats():
+    return {
+        "predict": mole_registry.current.batcher.stats(),
+        "diagnose_skin": skin_registry.current.batcher.stats(),
+        "pools": executors.pool_sizes(),
+        "cpu_plan": cpu_plan,
+        "advice": advice_store.stats(),
+        "result_cache": result_cache.stats(),
+        "admission": admission.stats(),
     }
 
 
+def collect_stats():
+    # Read at scrape time from the counters the components already keep
+    cache = result_cache.stats()
+    lookups = CounterMetricFamily("dermo_result_cache_lookups", "Result cache lookups by outcome", labels=["outcome"])
+    for outcome, key in [("hit", "hits"), ("disk_hit", "disk_hits"), ("coalesced", "coalesced"), ("miss", "misses")]:
+        lookups.add_metric([outcome], cache[key])
+    yield lookups
+    yield GaugeMetricFamily("dermo_result_cache_entries", "Results held in memory", value=cache["entries"])
+    depth = GaugeMetricFamily("dermo_batch_queue_depth", "Requests waiting for a batched forward", labels=["model"])
+    for registry in (mole_registry, skin_registry):
+        depth.add_metric([registry.kind], registry.current.batcher.queue_depth())
+    yield depth
+    advice = advice_store.stats()
+    yield GaugeMetricFamily("dermo_advice_stale", "Advice entries past their TTL", value=advice["stale"])
+    yield GaugeMetricFamily("dermo_advice_refreshing", "Advice refreshes in flight", value=advice["inflight"])
+    gates = admission.stats()["endpoints"]
+    waiting = GaugeMetricFamily("dermo_admission_waiting", "Requests queued for an admission slot", labels=["endpoint"])
+    rejected = CounterMetricFamily("dermo_admission_rejected", "Requests rejected for capacity", labels=["endpoint"])
+    for path, gate in gates.items():
+        waiting.add_metric([path], gate["waiting"])
+        rejected.add_metric([path], gate["rejected"])
+    yield waiting
+    yield rejected
+    if admission.rate_limiter is not None:
+        yield CounterMetricFamily("dermo_rate_limited", "Requests rejected by the per-client rate limit",
+                                  value=admission.rate_limiter.rejected)
+    yield GaugeMetricFamily("dermo_degraded", "1 while live LLM calls are skipped for load", value=int(admission.degraded))
+
+metrics.register_collector(collect_stats)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+# Not ready until every model has run each bucket size once, so no user request hits a cold graph
+readiness = {"ready": False, "error": None, "warmup_seconds": {}}
+warmup_task = None
+
+
+async def warm_up():
+    try:
+        for registry in (mole_registry, skin_registry):
+            serving = registry.current
+            timings = await executors.run_inference(warmup, serving.backend, serving.size, batch_buckets())
+            readiness["warmup_seconds"][registry.kind] = {str(bucket): round(seconds, 3) for bucket, seconds in timings.items()}
+        readiness["ready"] = True
+    except Exception as exc:
+        logger.exception("Warmup failed")
+        readiness["error"] = repr(exc)
+
+
+@app.get("/ready")
+async def ready():
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+
+# Model versions and hot-swap; disabled unless DERMO_ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("DERMO_ADMIN_TOKEN", "")
+registries = {"isic": mole_registry, "vit": skin_registry}
+
+
+def require_admin(x_admin_token: str = Header(default="")):
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def list_models():
+    return {kind: registry.info() for kind, registry in registries.items()}
+
+
+@app.post("/admin/models/{kind}/reload", dependencies=[Depends(require_admin)])
+async def reload_model(kind: str, path: Optional[str] = None):
+    """
+    Load new weights (the configured files, or path), warm them up and swap them in while serving
+    """
+    if kind not in registries:
+        raise HTTPException(status_code=404, detail=f"Unknown model {kind}")
+    try:
+        return await registries[kind].reload(path)
+    except (OSError, ValueError, RuntimeError, KeyError, EOFError, pickle.UnpicklingError) as exc:
+        # Missing, corrupt or foreign weights; the previous version keeps serving
+        raise HTTPException(status_code=409, detail=f"Reload failed: {exc}")
+
+
+@app.on_event("startup")
+async def startup():
+    advice_store.load()
+    advice_store.start(class_to_idx)
+    global warmup_task
+    warmup_task = asyncio.get_running_loop().create_task(warm_up())
+    for registry in registries.values():
+        registry.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for registry in registries.values():
+        await registry.stop()
+    await advice_store.stop()
+    await groq.close_client()
+    executors.shutdown()
+
+
 @app.get("/")
 async def root():
     return {"message": "Mole Evaluation API is running"} 
\ No newline at end of file
@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import time
+
+import torch
+
+from batching import batch_buckets
+from precision import BF16_MIN_AGREEMENT, PRECISION_CHECK_DIR, check_accuracy, prepare_model, resolve_precision
+from quantization import QUANTIZE, quantize_for_serving
+from result_cache import file_version
+from skin_diagnosis.token_merging import TOKEN_MERGE_RATIO
+
+# "torch" runs the eager model; "onnx" runs the exported graph in ONNX Runtime
+BACKEND = os.environ.get("DERMO_BACKEND", "torch")
+# Torch backend only: "none" (eager), "trace" (frozen TorchScript) or "inductor" (torch.compile)
+COMPILE = os.environ.get("DERMO_COMPILE", "none")
+# Synthetic forwards per batch-size bucket before the worker reports ready
+WARMUP_ROUNDS = int(os.environ.get("DERMO_WARMUP_ROUNDS", 2))
+# Empty follows torch's intra-op thread count (set by the CPU plan)
+ORT_INTRA_THREADS = os.environ.get("DERMO_ORT_INTRA_THREADS", "")
+ORT_INTER_THREADS = int(os.environ.get("DERMO_ORT_INTER_THREADS", 1))
+# Max abs logit difference tolerated between ONNX Runtime and the torch reference at startup
+ONNX_TOLERANCE = float(os.environ.get("DERMO_ONNX_TOLERANCE", 1e-3))
+# Early-exit bundles only: softmax confidence at which an image stops at an intermediate head (0 runs full depth)
+EXIT_THRESHOLD = float(os.environ.get("DERMO_EXIT_THRESHOLD", 0))
+
+logger = logging.getLogger(__name__)
+
+
+class TorchBackend:
+    """
+    Eager PyTorch forward returning fp32 logits on the CPU
+    Args:
+        model: Model in eval mode
+        device: Device the model lives on
+        bf16: Run under CPU bf16 autocast
+        channels_last: Feed NHWC inputs (the model should already be channels_last)
+    """
+    name = "torch"
+
+    def __init__(self, model, device, bf16=False, channels_last=False):
+        self.model = model
+        self.device = device
+        self.bf16 = bf16
+        self.channels_last = channels_last
+
+    def autocast(self):
+        return torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16)
+
+    def __call__(self, batch):
+        batch = batch.to(self.device)
+        if self.channels_last:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), self.autocast():
+            return self.model(batch).float().cpu()
+
+
+class EarlyExitBackend(TorchBackend):
+    """
+    Torch backend for an EarlyExitViTClassifier that stops each image at its first confident exit
+    Returns (fp32 logits, exit layer per row) instead of logits alone
+    Args:
+        threshold: Top softmax probability an exit head needs for the image to stop there
+        model, device, bf16, channels_last: As for TorchBackend
+    """
+    name = "torch-early-exit"
+
+    def __init__(self, model, device, threshold, bf16=False, channels_last=False):
+        super().__init__(model, device, bf16, channels_last)
+        self.threshold = threshold
+
+    def __call__(self, batch):
+        batch = batch.to(self.device)
+        with torch.no_grad(), self.autocast():
+            logits, exits = self.model.early_exit(batch, self.threshold)
+            return logits.float().cpu(), exits
+
+
+def compile_model(model, mode, example, autocast):
+    """
+    Args:
+        model: Model in eval mode
+        mode: "trace" or "inductor"
+        example: Input used to trace the graph
+        autocast: Autocast context the graph will run under (traced graphs record its casts)
+    """
+    if mode == "trace":
+        with torch.no_grad(), autocast:
+            traced = torch.jit.trace(model, example, check_trace=False)
+        # Freezing inlines the weights and folds constants; optimize_for_inference adds oneDNN fusions
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    if mode == "inductor":
+        # Static shapes: every bucket gets its own graph, compiled during warmup
+        return torch.compile(model, dynamic=False)
+    raise ValueError(f"Unknown DERMO_COMPILE {mode!r}")
+
+
+class CompiledBackend(TorchBackend):
+    """
+    Torch backend around a compiled graph that only ever sees the bucket batch sizes
+    Smaller batches are zero-padded up to the next bucket, larger ones split at the biggest
+    Args:
+        model: Model in eval mode
+        device: Device the model lives on
+        mode: "trace" or "inductor"
+        size: Input resolution
+        buckets: Ascending batch sizes to specialise for
+        bf16, channels_last: As for TorchBackend
+    """
+    def __init__(self, model, device, mode, size, buckets, bf16=False, channels_last=False):
+        super().__init__(model, device, bf16, channels_last)
+        example = torch.zeros(buckets[-1], 3, size, size, device=device)
+        if channels_last:
+            example = example.contiguous(memory_format=torch.channels_last)
+        self.model = compile_model(model, mode, example, self.autocast())
+        self.name = f"torch-{mode}"
+        self.buckets = buckets
+
+    def __call__(self, batch):
+        outputs = []
+        for chunk in batch.split(self.buckets[-1]):
+            rows = chunk.shape[0]
+            bucket = next(b for b in self.buckets if b >= rows)
+            if bucket > rows:
+                chunk = torch.cat([chunk, chunk.new_zeros(bucket - rows, *chunk.shape[1:])])
+            outputs.append(super().__call__(chunk)[:rows])
+        return torch.cat(outputs)
+
+
+def warmup(backend, size, buckets, rounds=WARMUP_ROUNDS):
+    """
+    Run synthetic batches of every bucket size so graphs, oneDNN primitives and the allocator are hot
+    Returns:
+        Seconds spent per bucket
+    """
+    timings = {}
+    for bucket in buckets:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            backend(torch.zeros(bucket, 3, size, size))
+        timings[bucket] = time.perf_counter() - start
+    return timings
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime CPU execution of a graph written by export_onnx.py
+    Args:
+        path: .onnx file with a dynamic batch axis
+        intra_threads: Threads used inside one operator (defaults to torch.get_num_threads())
+        inter_threads: Threads used to run independent operators in parallel
+    """
+    name = "onnx"
+
+    def __init__(self, path, intra_threads=None, inter_threads=ORT_INTER_THREADS):
+        import onnxruntime as ort
+
+        if intra_threads is None:
+            intra_threads = int(ORT_INTRA_THREADS) if ORT_INTRA_THREADS else torch.get_num_threads()
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_threads
+        options.inter_op_num_threads = inter_threads
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.path = path
+
+    def metadata(self):
+        props = self.session.get_modelmeta().custom_metadata_map
+        return json.loads(props["dermo_bundle"]) if "dermo_bundle" in props else None
+
+    def __call__(self, batch):
+        inputs = batch.to(torch.float32).contiguous().numpy()
+        return torch.from_numpy(self.session.run(None, {self.input_name: inputs})[0])
+
+
+def validate(backend, reference, size, samples=3, batch_size=2, tolerance=ONNX_TOLERANCE):
+    """
+    Compare a backend against the torch reference on random inputs; raises if they disagree
+    """
+    generator = torch.Generator().manual_seed(0)
+    worst = 0.0
+    for _ in range(samples):
+        batch = torch.randn(batch_size, 3, size, size, generator=generator)
+        worst = max(worst, (backend(batch) - reference(batch)).abs().max().item())
+    if worst > tolerance:
+        raise RuntimeError(f"{backend.name} backend differs from torch by {worst:.2e} (tolerance {tolerance:.0e})")
+    return worst
+
+
+def load_backend(model, bundle, weights_path, device, onnx_path, int8_path):
+    """
+    Build the configured backend for a loaded fp32 torch model
+    Returns:
+        (backend, version string identifying exactly what is being served)
+    """
+    if BACKEND == "onnx":
+        backend = OnnxBackend(onnx_path)
+        worst = validate(backend, TorchBackend(model, device), bundle["preprocessing"]["size"])
+        logger.info("ONNX %s validated against torch (max abs diff %.2e)", bundle["kind"], worst)
+        return backend, f"{file_version(onnx_path)}-onnx"
+    if BACKEND != "torch":
+        raise ValueError(f"Unknown DERMO_BACKEND {BACKEND!r}")
+    merging = ""
+    if TOKEN_MERGE_RATIO and hasattr(model, "merge_ratio"):
+        # Optional token merging (DERMO_TOKEN_MERGE_RATIO); the trained weights are used unchanged
+        model.merge_ratio = TOKEN_MERGE_RATIO
+        merging = f"-tome{TOKEN_MERGE_RATIO:g}"
+    # Optional INT8 serving (DERMO_QUANTIZE=int8)
+    if QUANTIZE == "int8" and int8_path and os.path.exists(int8_path) and os.path.getmtime(int8_path) < os.path.getmtime(weights_path):
+        # The artefact carries its own weights, so one older than the fp32 weights would serve a previous model
+        logger.warning("INT8 artefact %s predates %s; not using it", int8_path, weights_path)
+        int8_path = None
+    model, precision, artefact_path = quantize_for_serving(model, bundle, int8_path, device)
+    layout = {}
+    if precision == "fp32":
+        # Optional bf16 autocast / channels_last (DERMO_PRECISION)
+        model, precision, layout = serving_precision(model, bundle, device)
+    version = f"{file_version(artefact_path or weights_path)}-{precision}{merging}"
+    if EXIT_THRESHOLD and bundle.get("exit_layers"):
+        if COMPILE != "none":
+            # Which rows continue is data-dependent, so there is no fixed graph to compile
+            logger.warning("DERMO_COMPILE=%s does not apply to early exit; serving %s eager", COMPILE, bundle["kind"])
+        return EarlyExitBackend(model, device, EXIT_THRESHOLD, **layout), f"{version}-exit{EXIT_THRESHOLD:g}"
+    if COMPILE == "none":
+        return TorchBackend(model, device, **layout), version
+    try:
+        backend = CompiledBackend(model, device, COMPILE, bundle["preprocessing"]["size"], batch_buckets(), **layout)
+    except Exception:
+        logger.exception("Compiling %s with %s failed; serving eager", bundle["kind"], COMPILE)
+        return TorchBackend(model, device, **layout), version
+    return backend, version
+
+
+def serving_precision(model, bundle, device):
+    """
+    Resolve DERMO_PRECISION for an fp32 model, checking bf16 against fp32 when a reference set is configured
+    Returns:
+        (model, precision label, TorchBackend layout kwargs)
+    """
+    precision = resolve_precision(device)
+    if precision == "fp32":
+        return model, "fp32", {}
+    kind = bundle["kind"]
+    reference = TorchBackend(model, device)
+    model, bf16, channels_last = prepare_model(model, kind, precision)
+    layout = {"bf16": bf16, "channels_last": channels_last}
+    if PRECISION_CHECK_DIR:
+        drift = check_accuracy(kind, reference, TorchBackend(model, device, **layout), bundle["preprocessing"], PRECISION_CHECK_DIR)
+        logger.info("bf16 %s drift against fp32: %s", kind, drift)
+        if drift["label_agreement"] < BF16_MIN_AGREEMENT:
+            logger.warning("bf16 %s agrees with fp32 on %.1f%% of reference images; serving fp32",
+                           kind, 100 * drift["label_agreement"])
+            return model.to(memory_format=torch.contiguous_format), "fp32", {}
+    return model, precision, layout
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+from collections import Counter
+
+import torch
+
+import metrics
+
+MAX_BATCH_SIZE = int(os.environ.get("DERMO_MAX_BATCH_SIZE", 8))
+MAX_WAIT_MS = float(os.environ.get("DERMO_MAX_WAIT_MS", 5))
+
+
+def batch_buckets(max_batch_size=MAX_BATCH_SIZE):
+    """
+    Batch sizes a compiled forward is specialised for: powers of two up to max_batch_size, plus max_batch_size
+    """
+    buckets = [1]
+    while buckets[-1] * 2 < max_batch_size:
+        buckets.append(buckets[-1] * 2)
+    if buckets[-1] < max_batch_size:
+        buckets.append(max_batch_size)
+    return buckets
+
+
+class MicroBatcher:
+    """
+    Collects single-image requests for one model and runs them as one batched forward
+    Args:
+        forward: Callable taking a (N, C, H, W) tensor and returning a tensor with N rows
+        max_batch_size: Largest batch handed to forward
+        max_wait_ms: How long the first request of a batch waits for company
+        name: Label used in stats
+        executor: Executor the forward runs in (None uses the loop's default)
+    """
+
+    def __init__(self, forward, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, name="model", executor=None):
+        self.forward = forward
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+        self.executor = executor
+        self.batch_sizes = Counter()
+        self._queue = None
+        self._worker = None
+        self.closed = False
+
+    async def submit(self, tensor):
+        """
+        Queue a single (C, H, W) input and wait for its row of the batched output
+        """
+        if self.closed:
+            raise RuntimeError(f"{self.name} batcher is closed")
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, future, metrics.endpoint.get(), time.perf_counter()))
+        return await future
+
+    def _ensure_worker(self):
+        # The queue and worker are bound to the running loop, so create them lazily
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Anything already waiting rides along without extending the deadline
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (e.g. client disconnected) do not need a slot
+            batch = [item for item in batch if not item[1].cancelled()]
+            if not batch:
+                continue
+            self.batch_sizes[len(batch)] += 1
+            metrics.BATCH_SIZE.labels(self.name).observe(len(batch))
+            dispatched = time.perf_counter()
+            for _, _, route, enqueued in batch:
+                metrics.observe("queue_wait", self.name, dispatched - enqueued, route)
+            try:
+                inputs = torch.stack([item[0] for item in batch])
+                outputs, seconds = await loop.run_in_executor(self.executor, self._timed_forward, inputs)
+            except asyncio.CancelledError:
+                self._fail(batch)
+                raise
+            except Exception as exc:
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for row, (_, future, route, _) in zip(outputs, batch):
+                # Every request in the batch waited for the whole forward
+                metrics.observe("forward", self.name, seconds, route)
+                if not future.done():
+                    future.set_result(row)
+
+    def _fail(self, batch):
+        for _, future, _, _ in batch:
+            if not future.done():
+                future.set_exception(RuntimeError(f"{self.name} batcher is closed"))
+
+    def close(self):
+        # Stop the worker for good; callers should have drained their submissions first
+        self.closed = True
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        # Nothing left queued may wait forever
+        while self._queue is not None and not self._queue.empty():
+            self._fail([self._queue.get_nowait()])
+
+    def _timed_forward(self, inputs):
+        start = time.perf_counter()
+        outputs = self.forward(inputs)
+        return outputs, time.perf_counter() - start
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        items = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "model": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": batches,
+            "requests": items,
+            "mean_batch_size": items / batches if batches else 0.0,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+from backends import EarlyExitBackend, TorchBackend, serving_precision
+from bench.load_test import git_commit, percentiles
+from imaging import load_image
+from model_bundle import load_model
+from preprocessing import Preprocessor
+from quantization import image_paths
+
+
+def labelled_images(folder, classes, preprocessor, limit=None):
+    """
+    (tensor, label index) for every image under folder/<class name>/, as in ImageFolder
+    """
+    files = [(path, label) for label, name in enumerate(classes) for path in image_paths(os.path.join(folder, name))]
+    if not files:
+        raise ValueError(f"No images found under {folder}/<class>/")
+    # Spread the limit over all classes rather than taking the first ones; only the chosen images are decoded
+    step = max(1, len(files) // limit) if limit else 1
+    return [(preprocessor(load_image(path, preprocessor.size)), label) for path, label in files[::step][:limit]]
+
+
+def measure(backend, samples, rounds):
+    """
+    One image per forward, like a single /diagnose_skin request
+    """
+    latencies, correct, exits = [], 0, []
+    for tensor, label in samples:
+        batch = tensor.unsqueeze(0)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            outputs = backend(batch)
+            latencies.append(time.perf_counter() - start)
+        logits, exit_layers = outputs if isinstance(outputs, tuple) else (outputs, None)
+        correct += int(logits.argmax(dim=1).item() == label)
+        if exit_layers is not None:
+            exits.append(exit_layers.item())
+    result = {"accuracy": round(correct / len(samples), 4), "latency": percentiles(latencies)}
+    if exits:
+        result["mean_exit_layer"] = round(sum(exits) / len(exits), 2)
+        result["exit_layers"] = {str(layer): exits.count(layer) for layer in sorted(set(exits))}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request latency against accuracy of early-exit skin diagnosis')
+    parser.add_argument('bundle', type=str, help='Early-exit bundle written by train_early_exit.py')
+    parser.add_argument('--data', type=str, default='data/SkinDisease/test', help='Labelled images in <class>/ folders')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
+    parser.add_argument('--limit', type=int, default=500, help='Max images evaluated')
+    parser.add_argument('--rounds', type=int, default=1, help='Timed forwards per image')
+    parser.add_argument('--output', type=str, help='Also write the JSON report here')
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    model, bundle, _ = load_model('vit', [args.bundle], None, device)
+    if not bundle.get("exit_layers"):
+        parser.error(f"{args.bundle} has no exit heads; train them with train_early_exit.py")
+    # Same DERMO_PRECISION handling as the server
+    model, precision, layout = serving_precision(model, bundle, device)
+    samples = labelled_images(args.data, bundle["classes"], Preprocessor(**bundle["preprocessing"]), args.limit)
+
+    backends = {"full": TorchBackend(model, device, **layout)}
+    backends.update({f"exit{threshold:g}": EarlyExitBackend(model, device, threshold, **layout) for threshold in args.thresholds})
+    # Warm oneDNN and the allocator before anything is timed
+    for backend in backends.values():
+        backend(samples[0][0].unsqueeze(0))
+
+    results = {}
+    for name, backend in backends.items():
+        results[name] = measure(backend, samples, args.rounds)
+        print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "bundle": args.bundle,
+        "exit_layers": bundle["exit_layers"],
+        "precision": precision,
+        "images": len(samples),
+        "threads": torch.get_num_threads(),
+        "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("DERMO_")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# Phone photo sizes, from a downscaled upload to a full 12MP capture
+RESOLUTIONS = [(640, 480), (1280, 960), (4032, 3024)]
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def synthetic_jpeg(width, height, seed, quality=90):
+    """
+    A smooth skin-toned image with noise, so it compresses (and decodes) like a photo rather than pure noise
+    """
+    rng = np.random.default_rng(seed)
+    base = np.array([200, 150, 130], dtype=np.float32) + rng.normal(0, 20, 3)
+    coarse = rng.normal(0, 25, (max(2, height // 32), max(2, width // 32), 3)).astype(np.float32)
+    shading = np.asarray(Image.fromarray(np.clip(coarse + 128, 0, 255).astype(np.uint8)).resize((width, height), Image.BICUBIC))
+    pixels = base + shading.astype(np.float32) - 128 + rng.normal(0, 4, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def image_pool(resolutions=RESOLUTIONS, per_resolution=4, seed=0):
+    """
+    Returns:
+        [(resolution label, JPEG bytes)] cycling through the resolutions
+    """
+    pool = []
+    for index in range(per_resolution):
+        for width, height in resolutions:
+            pool.append((f"{width}x{height}", synthetic_jpeg(width, height, seed + len(pool))))
+    return pool
+
+
+def make_unique(jpeg, counter):
+    # Decoders stop at the end-of-image marker, so a trailing counter changes the content hash
+    # (and defeats the result cache) without changing the pixels
+    return jpeg + counter.to_bytes(8, "little")
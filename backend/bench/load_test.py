@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+
+from bench.images import RESOLUTIONS, image_pool, make_unique, parse_resolution
+from bench.mock_llm import serve_in_thread
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (path, multi-image upload)
+ENDPOINTS = {
+    "predict": ("/predict", False),
+    "diagnose_skin": ("/diagnose_skin", False),
+    "diagnose_skin_stream": ("/diagnose_skin?stream=true", False),
+    "analyze": ("/analyze", False),
+    "predict_batch": ("/predict/batch", True),
+    "diagnose_skin_batch": ("/diagnose_skin/batch", True),
+}
+
+
+def percentiles(seconds):
+    if not seconds:
+        return None
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def process_tree_peak_rss_mb(pid):
+    """
+    Sum of VmHWM (peak resident set) over a process and its descendants, e.g. uvicorn and its workers
+    """
+    total_kb, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), 0)
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def wait_ready(client, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/ready")
+            if response.status_code in (200, 404):
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {timeout}s")
+
+
+async def run_phase(client, path, multi, pool, requests, concurrency, batch_size, repeat, counter):
+    """
+    Send `requests` uploads to one endpoint from `concurrency` concurrent clients
+    """
+    latencies, first_bytes, statuses = [], [], Counter()
+    indices = itertools.count()
+
+    def payload(index):
+        _, jpeg = pool[index % len(pool)]
+        images = [jpeg if repeat else make_unique(jpeg, next(counter)) for _ in range(batch_size if multi else 1)]
+        if multi:
+            return [("files", (f"{index}-{k}.jpg", image, "image/jpeg")) for k, image in enumerate(images)]
+        return {"file": (f"{index}.jpg", images[0], "image/jpeg")}
+
+    async def send(index):
+        files = payload(index)
+        start = time.perf_counter()
+        first = None
+        async with client.stream("POST", path, files=files) as response:
+            async for _ in response.aiter_raw():
+                if first is None:
+                    first = time.perf_counter()
+        end = time.perf_counter()
+        statuses[str(response.status_code)] += 1
+        if response.status_code == 200:
+            latencies.append(end - start)
+            first_bytes.append((first or end) - start)
+
+    async def worker():
+        while (index := next(indices)) < requests:
+            try:
+                await send(index)
+            except httpx.HTTPError as exc:
+                statuses[type(exc).__name__] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    ok = len(latencies)
+    return {
+        "requests": requests,
+        "ok": ok,
+        "statuses": dict(statuses),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(ok / wall, 2),
+        "images_per_s": round(ok * (batch_size if multi else 1) / wall, 2),
+        "latency": percentiles(latencies),
+        "time_to_first_byte": percentiles(first_bytes),
+    }
+
+
+async def run(args, client, pool):
+    await wait_ready(client, args.ready_timeout)
+    counter = itertools.count()
+    results = {}
+    for name in args.endpoints:
+        path, multi = ENDPOINTS[name]
+        phase = dict(pool=pool, concurrency=args.concurrency, batch_size=args.batch_size, repeat=args.repeat, counter=counter)
+        if args.warmup:
+            await run_phase(client, path, multi, requests=args.warmup, **phase)
+        results[name] = await run_phase(client, path, multi, requests=args.requests, **phase)
+        print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+    return results
+
+
+async def run_in_process(args, pool):
+    import api
+
+    # Runs the app's startup/shutdown handlers, which ASGITransport does not
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            results = await run(args, client, pool)
+    return results, round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def run_against_url(args, pool, url, pid=None):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        results = await run(args, client, pool)
+    return results, process_tree_peak_rss_mb(pid) if pid else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the API with synthetic JPEGs and a local LLM stand-in')
+    parser.add_argument('--server', choices=['inprocess', 'uvicorn', 'url'], default='inprocess',
+                        help='Run the app in this process, as a local uvicorn server, or target --url')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='Server to target with --server url')
+    parser.add_argument('--port', type=int, default=8010, help='Port for --server uvicorn')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers for --server uvicorn')
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=['predict', 'diagnose_skin'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint first')
+    parser.add_argument('--batch-size', type=int, default=8, help='Images per request on batch endpoints')
+    parser.add_argument('--resolutions', nargs='+', type=parse_resolution, default=RESOLUTIONS,
+                        help='Image sizes as WIDTHxHEIGHT')
+    parser.add_argument('--images-per-resolution', type=int, default=4)
+    parser.add_argument('--repeat', action='store_true', help='Resend identical bytes (exercises the result cache)')
+    parser.add_argument('--llm-port', type=int, default=8012)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Mock LLM seconds before answering')
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.01)
+    parser.add_argument('--ready-timeout', type=float, default=600)
+    parser.add_argument('--label', type=str, default='', help='Name of the configuration under test')
+    parser.add_argument('--output', type=str, help='Also write the JSON report here')
+    args = parser.parse_args()
+
+    pool = image_pool(args.resolutions, args.images_per_resolution)
+    llm = None
+    if args.server != 'url':
+        llm = serve_in_thread(args.llm_port, latency=args.llm_latency, chunk_delay=args.llm_chunk_delay)
+        os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}"
+        os.environ.setdefault("GROQ_API_KEY", "bench")
+        # Keep the mock's advice and cached results out of the real stores, and start every run cold
+        scratch = tempfile.mkdtemp(prefix="dermo-bench-")
+        os.environ["DERMO_ADVICE_STORE"] = os.path.join(scratch, "advice_store.json")
+        if os.environ.get("DERMO_RESULT_CACHE_DB"):
+            os.environ["DERMO_RESULT_CACHE_DB"] = os.path.join(scratch, "result_cache.db")
+
+    server = None
+    try:
+        if args.server == 'inprocess':
+            results, peak_rss = asyncio.run(run_in_process(args, pool))
+        elif args.server == 'uvicorn':
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api:app", "--port", str(args.port), "--workers", str(args.workers),
+                 "--log-level", "warning"],
+                cwd=BACKEND_DIR, env={**os.environ, "DERMO_WORKERS": str(args.workers)}
+            )
+            results, peak_rss = asyncio.run(run_against_url(args, pool, f"http://127.0.0.1:{args.port}", server.pid))
+        else:
+            results, peak_rss = asyncio.run(run_against_url(args, pool, args.url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if llm is not None:
+            llm.should_exit = True
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "label": args.label,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "server": args.server,
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "batch_size": args.batch_size,
+            "resolutions": [f"{w}x{h}" for w, h in args.resolutions],
+            "repeat": args.repeat,
+            "workers": args.workers if args.server == 'uvicorn' else None,
+            "llm_latency": args.llm_latency if llm else None,
+            "cpu_count": os.cpu_count(),
+        },
+        "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("DERMO_")},
+        "peak_rss_mb": peak_rss,
+        "endpoints": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Same shape as groq.SYSTEM_PROMPT asks for (not imported: groq reads GROQ_BASE_URL at import time)
+ADVICE = json.dumps({
+    section: f"Synthetic {section.lower()} guidance for benchmarking."
+    for section in ["Info", "At-Home Treatment", "Clinical Treatment", "Severity"]
+})
+
+
+def create_app(latency=0.5, jitter=0.0, chunk_delay=0.01, chunk_size=16, failure_rate=0.0):
+    """
+    OpenAI-compatible /chat/completions stand-in for the Groq API
+    Args:
+        latency: Seconds before the answer (or the first streamed chunk)
+        jitter: Uniform +/- seconds added to latency
+        chunk_delay: Seconds between streamed chunks
+        chunk_size: Characters per streamed chunk
+        failure_rate: Fraction of calls answered with HTTP 503
+    """
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        await asyncio.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+        if random.random() < failure_rate:
+            return JSONResponse(status_code=503, content={"error": "synthetic failure"})
+        if not body.get("stream"):
+            return {"choices": [{"message": {"role": "assistant", "content": ADVICE}}]}
+
+        async def chunks():
+            for start in range(0, len(ADVICE), chunk_size):
+                delta = {"choices": [{"delta": {"content": ADVICE[start:start + chunk_size]}}]}
+                yield f"data: {json.dumps(delta)}\n\n"
+                await asyncio.sleep(chunk_delay)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def serve_in_thread(port, **options):
+    """
+    Start the mock on 127.0.0.1:port in a daemon thread; returns the uvicorn server (set should_exit to stop)
+    """
+    server = uvicorn.Server(uvicorn.Config(create_app(**options), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Mock LLM did not start on port {port}")
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local OpenAI-compatible stand-in for the Groq API')
+    parser.add_argument('--port', type=int, default=8012)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds before the answer or first chunk')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--chunk-delay', type=float, default=0.01, help='Seconds between streamed chunks')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.jitter, args.chunk_delay, failure_rate=args.failure_rate)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
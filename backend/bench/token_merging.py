@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+from backends import TorchBackend, serving_precision
+from batching import MAX_BATCH_SIZE
+from bench.early_exit import labelled_images
+from bench.load_test import git_commit, percentiles
+from model_bundle import load_any
+from preprocessing import Preprocessor
+
+
+def measure(backend, samples, batch_size, reference=None):
+    """
+    Classify every sample in batches of batch_size
+    Returns:
+        (report, predictions)
+    """
+    latencies, predictions = [], []
+    start = time.perf_counter()
+    for offset in range(0, len(samples), batch_size):
+        batch = torch.stack([tensor for tensor, _ in samples[offset:offset + batch_size]])
+        begin = time.perf_counter()
+        logits = backend(batch)
+        latencies.append(time.perf_counter() - begin)
+        predictions.extend(logits.argmax(dim=1).tolist())
+    wall = time.perf_counter() - start
+    labels = [label for _, label in samples]
+    report = {
+        "accuracy": round(sum(p == l for p, l in zip(predictions, labels)) / len(samples), 4),
+        "images_per_s": round(len(samples) / wall, 2),
+        "batch_latency": percentiles(latencies),
+    }
+    if reference is not None:
+        # How often merging changes the stock model's answer
+        report["agreement"] = round(sum(p == r for p, r in zip(predictions, reference)) / len(samples), 4)
+    return report, predictions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput against accuracy of token merging for the skin diagnosis ViT')
+    parser.add_argument('bundle', type=str, help='ViT bundle (or legacy checkpoint)')
+    parser.add_argument('--data', type=str, default='data/SkinDisease/test', help='Labelled images in <class>/ folders')
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0.05, 0.1, 0.15, 0.2, 0.25])
+    parser.add_argument('--batch-size', type=int, default=MAX_BATCH_SIZE, help='Images per forward (the micro-batch size)')
+    parser.add_argument('--limit', type=int, default=500, help='Max images evaluated')
+    parser.add_argument('--output', type=str, help='Also write the JSON report here')
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    model, bundle, _ = load_any('vit', args.bundle, device)
+    # Same DERMO_PRECISION handling as the server
+    model, precision, layout = serving_precision(model, bundle, device)
+    backend = TorchBackend(model, device, **layout)
+    samples = labelled_images(args.data, bundle["classes"], Preprocessor(**bundle["preprocessing"]), args.limit)
+
+    results, reference = {}, None
+    for ratio in [0.0] + args.ratios:
+        model.merge_ratio = ratio
+        # Warm oneDNN for this ratio's token counts before anything is timed
+        backend(torch.stack([tensor for tensor, _ in samples[:args.batch_size]]))
+        name = f"ratio{ratio:g}"
+        results[name], predictions = measure(backend, samples, args.batch_size, reference)
+        reference = reference or predictions
+        print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "bundle": args.bundle,
+        "precision": precision,
+        "images": len(samples),
+        "batch_size": args.batch_size,
+        "threads": torch.get_num_threads(),
+        "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("DERMO_")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import fcntl
+import logging
+import math
+import os
+import tempfile
+
+import torch
+
+from executors import INFERENCE_WORKERS
+
+# uvicorn processes sharing the host; uvicorn itself reads WEB_CONCURRENCY for --workers
+WORKERS = int(os.environ.get("DERMO_WORKERS", os.environ.get("WEB_CONCURRENCY", 1)))
+# Overrides for the computed plan (empty = computed)
+INTRA_THREADS = os.environ.get("DERMO_INTRA_THREADS", "")
+INTER_THREADS = os.environ.get("DERMO_INTER_THREADS", "")
+# Pin each worker to its own slice of cores ("1") or leave scheduling to the kernel ("0")
+CPU_AFFINITY = os.environ.get("DERMO_CPU_AFFINITY", "0") == "1"
+# Where workers take their slot lock files
+WORKER_SLOT_DIR = os.environ.get("DERMO_WORKER_SLOT_DIR", tempfile.gettempdir())
+
+logger = logging.getLogger(__name__)
+
+_slot_file = None
+
+
+def cgroup_cpu_limit():
+    """
+    CPU quota of this container in cores (cgroup v2 cpu.max or v1 cfs quota), or None if unlimited
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """
+    Returns:
+        (sorted CPU ids this process may run on, cores it may actually use after the cgroup quota)
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    limit = cgroup_cpu_limit()
+    usable = len(cpus) if limit is None else max(1, min(len(cpus), math.floor(limit)))
+    return cpus, usable
+
+
+def claim_worker_slot(workers, directory=WORKER_SLOT_DIR):
+    """
+    Take the first free slot in [0, workers) by holding an exclusive lock file for the life of the process
+    A worker that dies releases its lock, so its replacement reuses the same slot (and cores)
+    """
+    global _slot_file
+    for slot in range(workers):
+        f = open(os.path.join(directory, f"dermo-worker-{slot}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_file = f
+        return slot
+    # More processes than configured workers (e.g. during a rolling restart)
+    return os.getpid() % workers
+
+
+def make_plan(workers, cpus, usable, slot, inference_workers=INFERENCE_WORKERS):
+    """
+    Split the usable cores evenly across workers, then across each worker's concurrent forwards
+    """
+    cores_per_worker = max(1, usable // workers)
+    plan = {
+        "workers": workers,
+        "slot": slot,
+        "usable_cores": usable,
+        "cores_per_worker": cores_per_worker,
+        # Each inference pool thread runs its own forward with its own OpenMP team
+        "intra_op_threads": int(INTRA_THREADS) if INTRA_THREADS else max(1, cores_per_worker // inference_workers),
+        "inter_op_threads": int(INTER_THREADS) if INTER_THREADS else 1,
+        "affinity": None,
+    }
+    if CPU_AFFINITY and len(cpus) >= workers * cores_per_worker:
+        start = (slot % workers) * cores_per_worker
+        plan["affinity"] = cpus[start:start + cores_per_worker]
+    return plan
+
+
+def _pin(cores):
+    # sched_setaffinity(0) only covers the calling thread, so pin every thread already running too
+    try:
+        tids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        tids = [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except OSError:
+            pass
+
+
+def apply_plan(plan):
+    torch.set_num_threads(plan["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(plan["inter_op_threads"])
+    except RuntimeError:
+        # Only allowed before the first inter-op parallel work in the process
+        logger.warning("Inter-op thread count already fixed at %d", torch.get_num_interop_threads())
+        plan["inter_op_threads"] = torch.get_num_interop_threads()
+    if plan["affinity"]:
+        _pin(plan["affinity"])
+
+
+def plan_worker():
+    """
+    Compute and apply this process's thread/affinity plan; call before any model work
+    """
+    cpus, usable = available_cpus()
+    workers = max(1, WORKERS)
+    plan = make_plan(workers, cpus, usable, claim_worker_slot(workers))
+    apply_plan(plan)
+    plan["pid"] = os.getpid()
+    logger.info("CPU plan: %s", plan)
+    return plan
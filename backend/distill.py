@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import timm
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision.datasets import ImageFolder
+from torch.utils.data import DataLoader
+from sklearn.metrics import accuracy_score
+from tqdm import tqdm
+from transformers import get_linear_schedule_with_warmup
+from functools import partial
+from imaging import load_image
+from model_bundle import BUNDLE_FORMAT, load_any, load_model, save_bundle
+from preprocessing import Preprocessor
+from train import collate_fn
+
+
+def distillation_loss(student_logits, teacher_logits, labels, criterion, alpha, temperature):
+    """
+    alpha * KL(teacher || student) on temperature-softened targets + (1 - alpha) * cross-entropy on the labels
+    The KL term is scaled by T^2 so its gradients keep their size as the temperature changes
+    """
+    soft = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean",
+    ) * temperature ** 2
+    return alpha * soft + (1 - alpha) * criterion(student_logits, labels)
+
+
+def predictions(model, loader, device):
+    model.eval()
+    preds, labels = [], []
+    with torch.no_grad():
+        for pixel_values, batch_labels in tqdm(loader, desc="Testing", leave=False):
+            preds.extend(model(pixel_values.to(device)).argmax(dim=1).cpu().numpy())
+            labels.extend(batch_labels.numpy())
+    return np.array(preds), np.array(labels)
+
+
+def cpu_latency(model, size, batch_size, rounds=20):
+    """
+    Milliseconds per forward on the CPU at the serving resolution (after two warmup forwards)
+    """
+    model = model.cpu().eval()
+    batch = torch.zeros(batch_size, 3, size, size)
+    timings = []
+    with torch.no_grad():
+        for i in range(rounds + 2):
+            start = time.perf_counter()
+            model(batch)
+            if i >= 2:
+                timings.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(float(np.percentile(timings, 50)), 2), "mean_ms": round(float(np.mean(timings)), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distil the skin diagnosis ViT into a small timm student')
+    parser.add_argument('--teacher', type=str, default='weights/best_model.pth', help='Teacher ViT bundle or legacy checkpoint')
+    parser.add_argument('--output', type=str, default='weights/student_bundle.safetensors', help='Student bundle to write')
+    parser.add_argument('--report', type=str, help='Also write the comparison report here')
+    parser.add_argument('--student', type=str, default='mobilenetv3_large_100',
+                        help='timm architecture, e.g. mobilenetv3_large_100, efficientnet_b0, deit_tiny_patch16_224')
+    parser.add_argument('--no-pretrained', action='store_true', help='Start the student from random weights, not ImageNet')
+    parser.add_argument('--data', type=str, default='data/SkinDisease', help='ImageFolder root with train/ and test/')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--lr', type=float, default=5e-4)
+    parser.add_argument('--alpha', type=float, default=0.7, help='Weight of the soft-target KL term')
+    parser.add_argument('--temperature', type=float, default=4.0)
+    args = parser.parse_args()
+
+    DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    teacher, teacher_bundle, _ = load_any('vit', args.teacher, DEVICE)
+    classes = teacher_bundle["classes"]
+
+    # Same classes and preprocessing as the teacher, so the API can serve either from one decode
+    bundle = {
+        "format": BUNDLE_FORMAT,
+        "kind": "vit",
+        "config": {"model_name": args.student, "num_classes": len(classes)},
+        "preprocessing": teacher_bundle["preprocessing"],
+        "classes": classes,
+    }
+    student = timm.create_model(args.student, pretrained=not args.no_pretrained, num_classes=len(classes)).to(DEVICE)
+
+    preprocessor = Preprocessor(**bundle["preprocessing"])
+    collate = partial(collate_fn, processor=preprocessor)
+    loader = partial(load_image, target_size=preprocessor.size)
+    train_dataset = ImageFolder(f'{args.data}/train', loader=loader)
+    test_dataset = ImageFolder(f'{args.data}/test', loader=loader)
+    if train_dataset.classes != classes:
+        raise ValueError(f"{args.data} classes do not match the teacher's")
+
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, collate_fn=collate,
+                              pin_memory=True, num_workers=4)
+    test_loader = DataLoader(test_dataset, batch_size=args.batch_size, shuffle=False, collate_fn=collate,
+                             pin_memory=True, num_workers=4)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr)
+    num_training_steps = len(train_loader) * args.epochs
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer,
+        num_warmup_steps=int(0.1 * num_training_steps),
+        num_training_steps=num_training_steps
+    )
+
+    use_amp = DEVICE.type == 'cuda'
+    scaler = torch.amp.GradScaler('cuda', enabled=use_amp)
+    best_val_loss = float('inf')
+    temperance = 3
+    count = 0
+    teacher.eval()
+
+    for epoch in range(args.epochs):
+        print(f"\nEpoch {epoch+1}/{args.epochs}")
+        student.train()
+        total_loss = 0
+        train_loop = tqdm(train_loader, desc="Training", leave=False)
+
+        for pixel_values, labels in train_loop:
+            pixel_values, labels = pixel_values.to(DEVICE), labels.to(DEVICE)
+
+            optimizer.zero_grad()
+            with torch.amp.autocast(DEVICE.type, enabled=use_amp):
+                with torch.no_grad():
+                    teacher_logits = teacher(pixel_values)
+                loss = distillation_loss(student(pixel_values), teacher_logits, labels, criterion, args.alpha, args.temperature)
+
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            scheduler.step()
+
+            total_loss += loss.item()
+            train_loop.set_postfix(loss=loss.item())
+
+        avg_train_loss = total_loss / len(train_loader)
+        print(f"Train Loss: {avg_train_loss:.4f}")
+
+        # Validation
+        student.eval()
+        val_loss = 0
+        with torch.no_grad(), torch.amp.autocast(DEVICE.type, enabled=use_amp):
+            for pixel_values, labels in tqdm(test_loader, desc="Validating", leave=False):
+                pixel_values, labels = pixel_values.to(DEVICE), labels.to(DEVICE)
+                loss = distillation_loss(student(pixel_values), teacher(pixel_values), labels, criterion, args.alpha, args.temperature)
+                val_loss += loss.item()
+
+        avg_val_loss = val_loss / len(test_loader)
+        print(f"Val Loss: {avg_val_loss:.4f}")
+
+        # Save best student
+        if avg_val_loss < best_val_loss:
+            best_val_loss = avg_val_loss
+            save_bundle(args.output, bundle, student.state_dict())
+            print("Student Saved (best so far)")
+            count = 0
+        else:
+            count += 1
+            print(f"No improvement for {count} epochs.")
+            if count >= temperance:
+                print("Early stopping triggered.")
+                break
+
+    print("\nLoading best student for the comparison report...")
+    student, _, _ = load_model('vit', [args.output], None, DEVICE)
+    teacher_preds, labels = predictions(teacher, test_loader, DEVICE)
+    student_preds, _ = predictions(student, test_loader, DEVICE)
+
+    def summary(model, preds):
+        return {
+            "accuracy": accuracy_score(labels, preds),
+            "parameters_m": round(sum(p.numel() for p in model.parameters()) / 1e6, 2),
+            "cpu_latency_batch1": cpu_latency(model, preprocessor.size, 1),
+            "cpu_latency_batch8": cpu_latency(model, preprocessor.size, 8),
+        }
+
+    report = {
+        "student_architecture": args.student,
+        "output": args.output,
+        "test_images": len(labels),
+        "cpu_threads": torch.get_num_threads(),
+        "teacher": summary(teacher, teacher_preds),
+        "student": summary(student, student_preds),
+        "agreement_with_teacher": float((teacher_preds == student_preds).mean()),
+    }
+    report["speedup_batch1"] = round(
+        report["teacher"]["cpu_latency_batch1"]["p50_ms"] / report["student"]["cpu_latency_batch1"]["p50_ms"], 2
+    )
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    print(f"\nServe it with DERMO_SKIN_BUNDLE={os.path.abspath(args.output)} (or POST /admin/models/vit/reload?path=...)")
+
+
+if __name__ == "__main__":
+    main()
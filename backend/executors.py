@@ -0,0 +1,53 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# Decode/preprocess is PIL + small tensor work that releases the GIL for most of its time,
+# so a few threads per core keep it ahead of the (much heavier) model forwards.
+DECODE_WORKERS = int(os.environ.get("DERMO_DECODE_WORKERS", min(8, (os.cpu_count() or 1) * 2)))
+# Decode jobs allowed in the pool (running or queued); further uploads wait on the event loop
+DECODE_QUEUE_SIZE = int(os.environ.get("DERMO_DECODE_QUEUE_SIZE", DECODE_WORKERS * 4))
+# Each worker runs one batched forward at a time; torch parallelises inside the forward itself
+INFERENCE_WORKERS = int(os.environ.get("DERMO_INFERENCE_WORKERS", 2))
+
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="dermo-decode")
+inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="dermo-infer")
+
+_decode_slots = asyncio.Semaphore(DECODE_QUEUE_SIZE)
+
+
+def _in_context(fn, *args, **kwargs):
+    # Carry the caller's context vars (e.g. the metrics endpoint label) into the pool thread
+    return partial(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+async def run_decode(fn, *args, **kwargs):
+    """
+    Run a decode/preprocess step in the decode pool without blocking the event loop
+    """
+    async with _decode_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(decode_pool, _in_context(fn, *args, **kwargs))
+
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Run a model forward in the dedicated inference pool
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_pool, _in_context(fn, *args, **kwargs))
+
+
+def pool_sizes():
+    return {
+        "decode_workers": DECODE_WORKERS,
+        "decode_queue_size": DECODE_QUEUE_SIZE,
+        "inference_workers": INFERENCE_WORKERS,
+    }
+
+
+def shutdown():
+    decode_pool.shutdown(wait=False, cancel_futures=True)
+    inference_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,65 @@
+import argparse
+import inspect
+import json
+
+import torch
+
+from backends import OnnxBackend, TorchBackend, validate
+from model_bundle import load_any
+
+ONNX_OPSET = 17
+
+
+def export(model, bundle, output, opset=ONNX_OPSET):
+    """
+    Export a serving model to ONNX with a dynamic batch axis and the bundle metadata embedded
+    Args:
+        model: fp32 model in eval mode
+        bundle: Bundle metadata the model was built from
+        output: Path of the .onnx file to write
+    """
+    import onnx
+
+    size = bundle["preprocessing"]["size"]
+    kwargs = {}
+    # Newer torch defaults to the dynamo exporter; the TorchScript one handles both models as-is
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (torch.randn(1, 3, size, size),),
+            output,
+            input_names=["pixel_values"],
+            output_names=["logits"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+            do_constant_folding=True,
+            **kwargs
+        )
+
+    graph = onnx.load(output)
+    entry = graph.metadata_props.add()
+    entry.key = "dermo_bundle"
+    entry.value = json.dumps(bundle)
+    onnx.save(graph, output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a serving model to ONNX and check it against torch')
+    parser.add_argument('kind', choices=['isic', 'vit'], help='isic (mole model) or vit (skin diagnosis)')
+    parser.add_argument('bundle', type=str, help='Bundle (or legacy checkpoint) to export')
+    parser.add_argument('output', type=str, help='Where to write the .onnx graph')
+    parser.add_argument('--opset', type=int, default=ONNX_OPSET)
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    model, bundle, _ = load_any(args.kind, args.bundle, device)
+
+    export(model, bundle, args.output, args.opset)
+    worst = validate(OnnxBackend(args.output), TorchBackend(model, device), bundle["preprocessing"]["size"])
+    print(json.dumps({"output": args.output, "opset": args.opset, "max_abs_diff": worst}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
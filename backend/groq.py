@@ -1,27 +1,81 @@
+import asyncio
+import json
+import logging
 import os
+import re
+import time
+
+import httpx
 from dotenv import load_dotenv
-import requests
+
+import metrics
 
 
 load_dotenv()
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+# Point this at a local OpenAI-compatible stand-in for tests and benchmarks
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+GROQ_MODEL = os.environ.get("GROQ_MODEL", "llama-3.3-70b-versatile")
+GROQ_CONNECT_TIMEOUT = float(os.environ.get("GROQ_CONNECT_TIMEOUT", 2))
+GROQ_READ_TIMEOUT = float(os.environ.get("GROQ_READ_TIMEOUT", 20))
+# Hard cap on a whole call, including time spent waiting for a concurrency slot
+GROQ_DEADLINE = float(os.environ.get("GROQ_DEADLINE", 25))
+GROQ_MAX_CONCURRENCY = int(os.environ.get("GROQ_MAX_CONCURRENCY", 16))
 
-def get_medical_advice(diagnosis):
+FALLBACK_ADVICE = "No medical advice available. Please consult a healthcare professional."
 
-    url = "https://api.groq.com/openai/v1/chat/completions"
+SYSTEM_PROMPT = "You are a helpful medical assistant that provides medical advice. You are not a doctor. You will provide general information regarding the diagnosis given to you, provide at home steps for treatment, guidance for clinical treatment options, and a severity rating for how strongly you feel they should seek clinical medical attention. The format of your response should be a json where the first index is 'Info', with corresponding information about the condition, the second index should be 'At-Home Treatment' the third should be 'Clinical Treatment' and the last should be 'Severity', so how strongly you feel they should seek medical attention with a rational as to why. Always remind the user to consult a healthcare professional for personalized medical advice. Do not respond with any I statements or personal opinions. Always use third person language."
+
+ADVICE_SECTIONS = ["Info", "At-Home Treatment", "Clinical Treatment", "Severity"]
+
+logger = logging.getLogger(__name__)
+
+
+class IncompleteAdvice(Exception):
+    """
+    Raised by stream_medical_advice when the answer was cut short after some of it was yielded
+    """
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {GROQ_API_KEY}"
-    }
 
-    # Same request body as your cURL example
+_client = None
+_slots = asyncio.Semaphore(GROQ_MAX_CONCURRENCY)
+
+
+def get_client():
+    """
+    Shared keep-alive client; created on first use so it binds to the serving loop
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=GROQ_BASE_URL,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {GROQ_API_KEY}"
+            },
+            timeout=httpx.Timeout(GROQ_READ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=GROQ_MAX_CONCURRENCY,
+                max_keepalive_connections=GROQ_MAX_CONCURRENCY,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def build_payload(diagnosis, **extra):
     payload = {
-        "model": "llama-3.3-70b-versatile",
+        "model": GROQ_MODEL,
         "messages": [
         {
             "role": "system",
-            "content": "You are a helpful medical assistant that provides medical advice. You are not a doctor. You will provide general information regarding the diagnosis given to you, provide at home steps for treatment, guidance for clinical treatment options, and a severity rating for how strongly you feel they should seek clinical medical attention. The format of your response should be a json where the first index is 'Info', with corresponding information about the condition, the second index should be 'At-Home Treatment' the third should be 'Clinical Treatment' and the last should be 'Severity', so how strongly you feel they should seek medical attention with a rational as to why. Always remind the user to consult a healthcare professional for personalized medical advice. Do not respond with any I statements or personal opinions. Always use third person language."
+            "content": SYSTEM_PROMPT
         },
         {
             "role": "user",
@@ -29,12 +83,177 @@ def get_medical_advice(diagnosis):
         }
         ]
     }
+    payload.update(extra)
+    return payload
+
+
+async def _request_advice(diagnosis):
+    async with _slots:
+        response = await get_client().post("/chat/completions", json=build_payload(diagnosis))
+    response.raise_for_status()
+    return response.json().get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+
+
+async def get_medical_advice(diagnosis, deadline=GROQ_DEADLINE):
+    """
+    Ask the LLM for advice on a diagnosis
+    Args:
+        diagnosis: Predicted class name
+        deadline: Seconds before giving up and returning the fallback
+    Returns:
+        The advice text, or FALLBACK_ADVICE on timeout or upstream error
+    """
+    try:
+        with metrics.stage("llm", GROQ_MODEL):
+            advice = await asyncio.wait_for(_request_advice(diagnosis), deadline)
+    except asyncio.TimeoutError:
+        logger.warning("Groq call for %s exceeded %.1fs deadline", diagnosis, deadline)
+        return FALLBACK_ADVICE
+    except (httpx.HTTPError, ValueError) as exc:
+        logger.warning("Groq call for %s failed: %r", diagnosis, exc)
+        return FALLBACK_ADVICE
+    return advice if advice else FALLBACK_ADVICE
+
+
+async def stream_medical_advice(diagnosis, deadline=GROQ_DEADLINE):
+    """
+    Stream the advice for a diagnosis as content deltas (Groq `stream: true`)
+    Yields FALLBACK_ADVICE if nothing arrived before the deadline or the upstream failed
+    Raises IncompleteAdvice if the deadline or an upstream error cut the answer short
+    """
+    start = time.monotonic()
+    end = start + deadline
+    produced = False
+    try:
+        await asyncio.wait_for(_slots.acquire(), deadline)
+        try:
+            payload = build_payload(diagnosis, stream=True)
+            async with get_client().stream("POST", "/chat/completions", json=payload) as response:
+                response.raise_for_status()
+                lines = response.aiter_lines()
+                while True:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    try:
+                        line = await asyncio.wait_for(lines.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data).get("choices", [{}])[0].get("delta", {}).get("content")
+                    if delta:
+                        produced = True
+                        yield delta
+        finally:
+            _slots.release()
+    except asyncio.TimeoutError:
+        logger.warning("Groq stream for %s exceeded %.1fs deadline", diagnosis, deadline)
+        failure = "deadline exceeded"
+    except (httpx.HTTPError, ValueError) as exc:
+        logger.warning("Groq stream for %s failed: %r", diagnosis, exc)
+        failure = repr(exc)
+    else:
+        failure = None
+    metrics.observe("llm", GROQ_MODEL, time.monotonic() - start)
+    if not produced:
+        yield FALLBACK_ADVICE
+    elif failure is not None:
+        raise IncompleteAdvice(f"Advice for {diagnosis} cut short: {failure}")
+
+
+_SECTION_KEY = re.compile(r'"(' + "|".join(re.escape(name) for name in ADVICE_SECTIONS) + r')"\s*:\s*(\S)')
+
+
+class SectionStreamParser:
+    """
+    Incrementally pulls the ADVICE_SECTIONS values out of a partially received JSON answer
+    feed() returns (section, text) pieces as soon as their characters are complete
+    String values are unescaped; any other value (list/object) is passed through as raw JSON
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.section = None
+        self.raw = False
+        self.depth = 0
+        self.in_string = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        pieces = []
+        while True:
+            if self.section is None:
+                match = _SECTION_KEY.search(self.buffer, self.pos)
+                if match is None:
+                    break
+                self.section = match.group(1)
+                self.raw = match.group(2) != '"'
+                self.depth = 0
+                self.in_string = False
+                # Skip the opening quote of a string value; raw values keep their first char
+                self.pos = match.end(2) if not self.raw else match.start(2)
+            text, done = self._consume_raw() if self.raw else self._consume_string()
+            if text:
+                pieces.append((self.section, text))
+            if not done:
+                break
+            self.section = None
+        return pieces
+
+    def _consume_string(self):
+        out = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if char == '"':
+                self.pos += 1
+                return "".join(out), True
+            if char == "\\":
+                length = 6 if self.buffer[self.pos + 1:self.pos + 2] == "u" else 2
+                escape = self.buffer[self.pos:self.pos + length]
+                if len(escape) < length:
+                    break
+                try:
+                    out.append(json.loads('"' + escape + '"'))
+                except ValueError:
+                    out.append(escape)
+                self.pos += length
+                continue
+            out.append(char)
+            self.pos += 1
+        return "".join(out), False
+
+    def _consume_raw(self):
+        start = self.pos
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if self.in_string:
+                if char == "\\":
+                    if self.pos + 1 >= len(self.buffer):
+                        break
+                    self.pos += 1
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in "[{":
+                self.depth += 1
+            elif char in "]}":
+                if self.depth == 0:
+                    return self.buffer[start:self.pos].rstrip(), True
+                self.depth -= 1
+            elif char == "," and self.depth == 0:
+                return self.buffer[start:self.pos].rstrip(), True
+            self.pos += 1
+        # Hold back trailing whitespace: it is only dropped if the delimiter follows it
+        text = self.buffer[start:self.pos].rstrip()
+        self.pos = start + len(text)
+        return text, False
 
-    response = requests.post(url, headers=headers, json=payload)
-    print("Status Code:", response.status_code)
-    print("Response:", response.json())
-    response = response.json().get("choices", [{}])[0].get("message", {}).get("content", "No response received.").strip()
-    print(response)
-    return response if response else "No medical advice available. Please consult a healthcare professional."
 
-print(get_medical_advice("skin cancer"))  # Example usage, replace with actual diagnosis
\ No newline at end of file
+if __name__ == "__main__":
+    print(asyncio.run(get_medical_advice("skin cancer")))  # Example usage, replace with actual diagnosis
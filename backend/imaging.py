@@ -0,0 +1,49 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+
+# Decompression-bomb guard, checked against the header before any pixel is decoded
+MAX_IMAGE_PIXELS = int(os.environ.get("DERMO_MAX_IMAGE_PIXELS", 40_000_000))
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def decode_image(source, target_size=None, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Decode an image to RGB, only as large as the model needs
+    Args:
+        source: Raw bytes, a path or a file object
+        target_size: Smallest side length the caller will resize to (None decodes at full size)
+        max_pixels: Reject images whose header declares more pixels than this
+    Returns:
+        An RGB PIL image with EXIF orientation applied
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Image is {width}x{height}, limit is {max_pixels} pixels")
+
+    if target_size:
+        # JPEG only: let libjpeg do a DCT-domain 1/2, 1/4 or 1/8 downscale while decoding,
+        # stopping at the largest scale that still covers target_size on both sides.
+        # Asking for "RGB" also folds the YCbCr->RGB conversion into the decoder.
+        image.draft("RGB", (target_size, target_size))
+
+    # Rotating in place avoids the copy exif_transpose otherwise makes of every image
+    ImageOps.exif_transpose(image, in_place=True)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+
+def load_image(path, target_size=None):
+    """
+    ImageFolder-compatible loader built on decode_image
+    """
+    with open(path, "rb") as f:
+        return decode_image(f, target_size)
@@ -0,0 +1,115 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from fastapi.responses import JSONResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, disable_created_metrics, generate_latest
+)
+
+# Seconds; spans a cached hit (sub-millisecond) to a cold LLM call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# *_created series double the scrape size for no use here
+disable_created_metrics()
+registry = CollectorRegistry()
+
+# Route of the request being served; work outside a request (advice refresh, warmup) is "background".
+# executors copy the context into their threads, so stages timed there keep the label
+endpoint = contextvars.ContextVar("dermo_endpoint", default="background")
+
+STAGE_SECONDS = Histogram(
+    "dermo_stage_seconds", "Time spent per request stage",
+    ["endpoint", "stage", "model"], buckets=LATENCY_BUCKETS, registry=registry
+)
+BATCH_SIZE = Histogram(
+    "dermo_batch_size", "Images per model forward",
+    ["model"], buckets=(1, 2, 4, 8, 16, 32, 64), registry=registry
+)
+IN_FLIGHT = Gauge("dermo_in_flight_requests", "Requests currently being handled", ["endpoint"], registry=registry)
+ERRORS = Counter("dermo_errors_total", "Failed requests (HTTP status) and undecodable batch images", ["endpoint", "kind"], registry=registry)
+
+
+def observe(stage, model, seconds, route=None):
+    STAGE_SECONDS.labels(route or endpoint.get(), stage, model).observe(seconds)
+
+
+@contextmanager
+def stage(name, model="none"):
+    """
+    Time a block as one stage of the current request
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, model, time.perf_counter() - start)
+
+
+class _Collector:
+    def __init__(self, collect):
+        self.collect = collect
+
+
+def register_collector(collect):
+    """
+    Export values computed at scrape time (existing stats counters, queue depths)
+    Args:
+        collect: Callable yielding prometheus_client metric families
+    """
+    registry.register(_Collector(collect))
+
+
+def render():
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class TimedJSONResponse(JSONResponse):
+    """
+    Default response class that records JSON serialisation as its own stage
+    """
+    def render(self, content):
+        with stage("serialize"):
+            return super().render(content)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: labels the request with its route, tracks in-flight requests, total time and errors
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def _route(self, scope):
+        if self._routes is None:
+            self._routes = {route.path for route in scope["app"].routes}
+        return scope["path"] if scope["path"] in self._routes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self._route(scope)
+        token = endpoint.set(route)
+        status = []
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            ERRORS.labels(route, "exception").inc()
+            raise
+        finally:
+            in_flight.dec()
+            observe("total", "none", time.perf_counter() - start, route)
+            endpoint.reset(token)
+        if status and status[0] >= 400:
+            ERRORS.labels(route, str(status[0])).inc()
@@ -0,0 +1,186 @@
+import argparse
+import itertools
+import json
+import os
+import struct
+
+import timm
+import torch
+from safetensors.torch import save_file
+
+from mole_model.evaluate_model import ISICModel
+from preprocessing import MOLE_IMAGE_SIZE, MOLE_MEAN, MOLE_STD, SKIN_IMAGE_SIZE, SKIN_MEAN, SKIN_STD
+from skin_diagnosis.model import EarlyExitViTClassifier, ViTClassifier, class_to_idx, load_vit_config
+
+BUNDLE_FORMAT = 1
+
+# What a legacy .pt/.pth checkpoint implicitly assumes about its model
+DEFAULT_BUNDLES = {
+    "isic": {
+        "config": {"model_name": "edgenext_base.in21k_ft_in1k", "num_classes": 1, "global_pool": "avg"},
+        "preprocessing": {"size": MOLE_IMAGE_SIZE, "mean": MOLE_MEAN, "std": MOLE_STD},
+    },
+    "vit": {
+        "config": None,  # filled from skin_diagnosis/vit_config.json
+        "preprocessing": {"size": SKIN_IMAGE_SIZE, "mean": SKIN_MEAN, "std": SKIN_STD},
+        "classes": sorted(class_to_idx, key=class_to_idx.get),
+    },
+}
+
+
+def default_bundle(kind):
+    bundle = {"format": BUNDLE_FORMAT, "kind": kind, **DEFAULT_BUNDLES[kind]}
+    if kind == "vit" and bundle["config"] is None:
+        bundle["config"] = load_vit_config().to_dict()
+    return bundle
+
+
+def build_model(bundle):
+    """
+    Instantiate the bundle's architecture with random weights (no pretrained download)
+    """
+    config = bundle["config"]
+    if bundle["kind"] == "isic":
+        return ISICModel(config["model_name"], num_classes=config["num_classes"], pretrained=False)
+    if bundle["kind"] == "vit":
+        if "model_name" in config:
+            # Distilled timm student (distill.py), a drop-in for the ViT with the same classes and preprocessing
+            return timm.create_model(config["model_name"], num_classes=len(bundle["classes"]), pretrained=False)
+        if bundle.get("exit_layers"):
+            # Written by train_early_exit.py
+            return EarlyExitViTClassifier(len(bundle["classes"]), config=config, exit_layers=bundle["exit_layers"])
+        return ViTClassifier(len(bundle["classes"]), config=config)
+    raise ValueError(f"Unknown model kind {bundle['kind']!r}")
+
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+def save_bundle(path, bundle, state_dict):
+    """
+    Write a bundle; a .safetensors path stores the metadata in the file header
+    """
+    if path.endswith(".safetensors"):
+        tensors = {name: tensor.contiguous() for name, tensor in state_dict.items()}
+        save_file(tensors, path, metadata={"dermo_bundle": json.dumps(bundle)})
+    else:
+        torch.save({**bundle, "state_dict": state_dict}, path)
+
+
+def mmap_safetensors(path):
+    """
+    Map a .safetensors file read-only into memory and return (tensors, metadata)
+    The tensors are views of a MAP_PRIVATE mapping, so every worker that loads the same
+    file shares its pages through the page cache instead of holding a private copy
+    """
+    with open(path, "rb") as f:
+        header_length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_length))
+    metadata = header.pop("__metadata__", {})
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data_start = 8 + header_length
+    tensors = {}
+    for name, info in header.items():
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        item_size = torch.empty((), dtype=dtype).element_size()
+        if (data_start + start) % item_size:
+            # Misaligned for this dtype; only this tensor pays for a copy
+            raw = torch.empty(0, dtype=torch.uint8).set_(storage, data_start + start, (end - start,))
+            tensors[name] = raw.clone().view(dtype).reshape(info["shape"])
+        else:
+            tensors[name] = torch.empty(0, dtype=dtype).set_(storage, (data_start + start) // item_size, info["shape"])
+    return tensors, metadata
+
+
+def load_bundle(path, map_location="cpu"):
+    if path.endswith(".safetensors"):
+        state_dict, metadata = mmap_safetensors(path)
+        if "dermo_bundle" not in metadata:
+            raise ValueError(f"{path} has no bundle metadata")
+        bundle = json.loads(metadata["dermo_bundle"])
+        bundle["state_dict"] = state_dict
+    else:
+        # weights_only: bundles hold tensors and plain metadata, and a path may come from the admin API
+        bundle = torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+    if bundle.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"{path} is not a format {BUNDLE_FORMAT} model bundle")
+    return bundle
+
+
+def _instantiate(bundle, state_dict, strict):
+    # Build on the meta device and adopt the loaded tensors as-is, so no random init
+    # is computed and mmap'd weights are not copied into private memory
+    try:
+        with torch.device("meta"):
+            model = build_model(bundle)
+    except (NotImplementedError, RuntimeError):
+        # Some constructors compute with real values (e.g. timm's drop-path schedules use .tolist()/.item())
+        model = build_model(bundle)
+        model.load_state_dict(state_dict, strict=strict)
+        return model
+    model.load_state_dict(state_dict, strict=strict, assign=True)
+    if any(t.is_meta for t in itertools.chain(model.parameters(), model.buffers())):
+        # Something the checkpoint does not carry (e.g. a non-persistent buffer); build for real
+        model = build_model(bundle)
+        model.load_state_dict(state_dict, strict=strict, assign=True)
+    return model
+
+
+def load_model(kind, bundle_paths, checkpoint_path, device):
+    """
+    Load a serving model from the first bundle that exists, falling back to a legacy checkpoint plus defaults
+    Returns:
+        (model in eval mode on device, bundle metadata without the weights, path the weights came from)
+    """
+    for bundle_path in bundle_paths:
+        if bundle_path and os.path.exists(bundle_path):
+            bundle = load_bundle(bundle_path, map_location="cpu")
+            state_dict, strict, source = bundle.pop("state_dict"), True, bundle_path
+            break
+    else:
+        bundle = default_bundle(kind)
+        # Legacy skin checkpoints were always loaded non-strictly
+        state_dict = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+        strict, source = kind != "vit", checkpoint_path
+    model = _instantiate(bundle, state_dict, strict)
+    return model.to(device).eval(), bundle, source
+
+
+def load_any(kind, path, device):
+    """
+    Load a serving model from one file that is either a bundle or a legacy checkpoint
+    Returns:
+        Same as load_model
+    """
+    try:
+        return load_model(kind, [path], None, device)
+    except ValueError:
+        # Not a bundle: treat it as a legacy checkpoint
+        return load_model(kind, [], path, device)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bundle a legacy checkpoint with its config and preprocessing constants')
+    parser.add_argument('kind', choices=sorted(DEFAULT_BUNDLES), help='isic (mole model) or vit (skin diagnosis)')
+    parser.add_argument('checkpoint', type=str, help='Path to the .pt/.pth state dict')
+    parser.add_argument('output', type=str, help='Where to write the bundle (.safetensors for mmap loading, .pt otherwise)')
+    args = parser.parse_args()
+
+    bundle = default_bundle(args.kind)
+    state_dict = torch.load(args.checkpoint, map_location="cpu")
+    model = build_model(bundle)
+    # Round-trip through the model so the bundle holds exactly what strict loading expects
+    missing, unexpected = model.load_state_dict(state_dict, strict=False)
+    if missing or unexpected:
+        print(f"Warning: missing keys {missing}, unexpected keys {unexpected}")
+    save_bundle(args.output, bundle, model.state_dict())
+    print(f"Wrote {args.kind} bundle to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import asyncio
+import gc
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import executors
+from backends import BACKEND, load_backend, warmup
+from batching import MicroBatcher, batch_buckets
+from model_bundle import load_any, load_model
+from preprocessing import Preprocessor
+from tta import augmented_views
+
+# Poll the weight files this often and hot-swap when they change (0 disables)
+MODEL_WATCH_INTERVAL = float(os.environ.get("DERMO_MODEL_WATCH_INTERVAL", 0))
+# Longest a retired version waits for its in-flight requests before it is released anyway
+MODEL_DRAIN_TIMEOUT = float(os.environ.get("DERMO_MODEL_DRAIN_TIMEOUT", 60))
+
+logger = logging.getLogger(__name__)
+
+
+class ServingModel:
+    """
+    One loaded, servable version of a model, with its own batcher
+    Requests pin a version with use() for their whole lifetime, so a swap never mixes versions
+    within a request and the old version can be drained before it is released
+    Once closed, a version refuses new work instead of running on a stopped batcher
+    """
+
+    def __init__(self, kind, backend, bundle, version, source, postprocess, signature=None):
+        self.kind = kind
+        self.backend = backend
+        self.bundle = bundle
+        self.version = version
+        self.source = source
+        # (path, mtime, size) of the weights (and ONNX graph) when they were loaded
+        self.signature = signature
+        self.postprocess = postprocess
+        self.preprocessor = Preprocessor(**bundle["preprocessing"])
+        self.size = self.preprocessor.size
+        self.classes = bundle.get("classes")
+        self.batcher = MicroBatcher(self.forward, name=kind, executor=executors.inference_pool)
+        self.loaded_at = time.time()
+        self.users = 0
+        self.closed = False
+        self._drained = None
+
+    def _check_open(self):
+        if self.closed:
+            raise RuntimeError(f"{self.kind} {self.version} has been retired")
+
+    def forward(self, batch):
+        self._check_open()
+        outputs = self.backend(batch)
+        if isinstance(outputs, tuple):
+            # Early exit: one (probabilities, exit layer) pair per row
+            logits, exits = outputs
+            return list(zip(self.postprocess(logits), exits.tolist()))
+        return self.postprocess(outputs)
+
+    def forward_tta(self, tensor):
+        """
+        Test-time augmentation: every augmented view of one image in a single batched forward,
+        with the logits averaged before postprocessing
+        Returns:
+            One row, shaped like a row of forward()
+        """
+        self._check_open()
+        outputs = self.backend(augmented_views(tensor))
+        if isinstance(outputs, tuple):
+            # Early exit: report the deepest exit any view needed
+            logits, exits = outputs
+            return self.postprocess(logits.mean(dim=0, keepdim=True))[0], max(exits.tolist())
+        return self.postprocess(outputs.mean(dim=0, keepdim=True))[0]
+
+    @contextmanager
+    def use(self):
+        self._check_open()
+        self.users += 1
+        try:
+            yield self
+        finally:
+            self.users -= 1
+            if self.users == 0 and self._drained is not None:
+                self._drained.set()
+
+    async def drain(self, timeout=MODEL_DRAIN_TIMEOUT):
+        """
+        Wait until no request holds this version any more; returns False on timeout
+        """
+        self._drained = asyncio.Event()
+        if self.users == 0:
+            self._drained.set()
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        self.closed = True
+        self.batcher.close()
+
+    def info(self):
+        return {
+            "kind": self.kind,
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "in_flight": self.users,
+        }
+
+
+def _signature(*paths):
+    # (path, mtime, size) of every file a version is built from
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ModelRegistry:
+    """
+    The serving version of one model kind, replaceable while requests keep flowing
+    A reload loads and warms the new version off the event loop, swaps it in with a single
+    assignment, then drains and releases the old one
+    Args:
+        kind: "isic" or "vit"
+        bundle_paths: Bundle candidates in priority order (None entries are skipped)
+        checkpoint_path: Legacy checkpoint used when no bundle exists
+        device: Device to load onto
+        postprocess: Applied to the backend's logits (sigmoid/softmax)
+        onnx_path, int8_path: Artefacts for the optional backends
+        on_swap: Called with (old, new) versions right after a swap
+    """
+
+    def __init__(self, kind, bundle_paths, checkpoint_path, device, postprocess, onnx_path=None, int8_path=None,
+                 on_swap=None):
+        self.kind = kind
+        self.bundle_paths = [path for path in bundle_paths if path]
+        self.checkpoint_path = checkpoint_path
+        self.device = device
+        self.postprocess = postprocess
+        self.onnx_path = onnx_path
+        self.int8_path = int8_path
+        self.on_swap = on_swap
+        self.swaps = []
+        self._lock = None
+        self._watcher = None
+        self._failed = None
+        self.current = self.load()
+
+    def _resolved_source(self):
+        # The file load() would pick right now
+        for path in self.bundle_paths + [self.checkpoint_path]:
+            if path and os.path.exists(path):
+                return path
+        return None
+
+    def _sources(self, source):
+        # Under DERMO_BACKEND=onnx the graph is served, so it is watched along with the weights
+        return [source, self.onnx_path] if BACKEND == "onnx" else [source]
+
+    def load(self, path=None):
+        """
+        Load a version without serving it
+        Args:
+            path: Bundle or legacy checkpoint to load (default: the configured candidates)
+        """
+        if path is not None and BACKEND == "onnx":
+            # The served graph carries its own weights and always comes from onnx_path
+            raise RuntimeError(f"DERMO_BACKEND=onnx serves {self.onnx_path}; export the new weights to it "
+                               f"with export_onnx.py and reload without a path")
+        if path is None:
+            model, bundle, source = load_model(self.kind, self.bundle_paths, self.checkpoint_path, self.device)
+        else:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No weights at {path}")
+            model, bundle, source = load_any(self.kind, path, self.device)
+        signature = _signature(*self._sources(source))
+        try:
+            backend, version = load_backend(model, bundle, source, self.device, self.onnx_path, self.int8_path)
+        except RuntimeError as exc:
+            if BACKEND != "onnx":
+                raise
+            raise RuntimeError(f"{self.onnx_path} does not match {source} ({exc}); re-export it with export_onnx.py")
+        return ServingModel(self.kind, backend, bundle, version, source, self.postprocess, signature)
+
+    def _load_and_warm(self, path):
+        serving = self.load(path)
+        warmup(serving.backend, serving.size, batch_buckets())
+        return serving
+
+    async def reload(self, path=None):
+        """
+        Load, warm up and swap in a new version; the old one keeps serving until the swap
+        Returns:
+            Info on the version now serving
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            started = time.monotonic()
+            new = await loop.run_in_executor(None, self._load_and_warm, path)
+            old, self.current = self.current, new
+            logger.info("Swapped %s %s -> %s", self.kind, old.version, new.version)
+            if self.on_swap is not None:
+                self.on_swap(old, new)
+            drained = await old.drain()
+            if not drained:
+                logger.warning("%s %s still had %d requests after %.0fs; releasing it anyway",
+                               self.kind, old.version, old.users, MODEL_DRAIN_TIMEOUT)
+            old.close()
+            del old
+            gc.collect()
+            self.swaps.append({
+                "version": new.version,
+                "source": new.source,
+                "at": time.time(),
+                "seconds": round(time.monotonic() - started, 3),
+                "drained": drained,
+            })
+            del self.swaps[:-10]
+            return new.info()
+
+    async def watch(self, interval=MODEL_WATCH_INTERVAL):
+        """
+        Reload whenever the weight file the registry would load (or the ONNX graph it serves) changes,
+        after it stops changing
+        """
+        pending = None
+        while True:
+            await asyncio.sleep(interval)
+            source = self._resolved_source()
+            if source is None:
+                continue
+            try:
+                signature = _signature(*self._sources(source))
+            except OSError:
+                continue
+            if signature in (self.current.signature, self._failed):
+                pending = None
+            elif signature != pending:
+                # Still being written (or just appeared): wait one more interval for it to settle
+                pending = signature
+            else:
+                pending = None
+                try:
+                    await self.reload()
+                except Exception:
+                    logger.exception("Hot reload of %s from %s failed; keeping %s", self.kind, source, self.current.version)
+                    # Do not retry the same broken file every interval
+                    self._failed = signature
+
+    def start(self, interval=MODEL_WATCH_INTERVAL):
+        if interval > 0 and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self.watch(interval))
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    def info(self):
+        return {**self.current.info(), "swaps": self.swaps}
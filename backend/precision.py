@@ -0,0 +1,92 @@
+import argparse
+import json
+import logging
+import os
+
+import torch
+
+from quantization import drift_report, folder_batches
+
+# "fp32", "bf16" (bf16 autocast + channels_last where it helps) or "auto" (bf16 if the CPU has native support)
+PRECISION = os.environ.get("DERMO_PRECISION", "fp32")
+# Optional folder of reference images; bf16 is only served if it agrees with fp32 on them
+PRECISION_CHECK_DIR = os.environ.get("DERMO_PRECISION_CHECK_DIR", "")
+PRECISION_CHECK_LIMIT = int(os.environ.get("DERMO_PRECISION_CHECK_LIMIT", 64))
+BF16_MIN_AGREEMENT = float(os.environ.get("DERMO_BF16_MIN_AGREEMENT", 0.99))
+
+logger = logging.getLogger(__name__)
+
+
+def bf16_supported():
+    """
+    True when oneDNN has native bf16 kernels on this CPU (AVX512-BF16 or AMX)
+    Without them bf16 is emulated and slower than fp32
+    """
+    if not torch.backends.mkldnn.is_available():
+        return False
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(device, requested=PRECISION):
+    if requested not in ("fp32", "bf16", "auto"):
+        raise ValueError(f"Unknown DERMO_PRECISION {requested!r}")
+    if requested == "fp32":
+        return "fp32"
+    if device.type != "cpu":
+        logger.warning("bf16 serving is implemented for CPU only; keeping fp32 on %s", device)
+        return "fp32"
+    if not bf16_supported():
+        if requested == "bf16":
+            logger.warning("CPU lacks native bf16 (AVX512-BF16/AMX); keeping fp32")
+        return "fp32"
+    return "bf16"
+
+
+def uses_channels_last(kind):
+    # EdgeNeXt is convolutional, so oneDNN prefers NHWC; the ViT only convolves once (patch embedding)
+    return kind == "isic"
+
+
+def prepare_model(model, kind, precision):
+    """
+    Lay the model out for the given precision; returns (model, autocast enabled, channels_last)
+    """
+    channels_last = precision == "bf16" and uses_channels_last(kind)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model, precision == "bf16", channels_last
+
+
+def check_accuracy(kind, reference, candidate, preprocessing, folder, limit=PRECISION_CHECK_LIMIT):
+    """
+    Drift of a candidate forward against the fp32 reference on a folder of images
+    """
+    return drift_report(kind, reference, candidate, folder_batches(folder, preprocessing, limit=limit))
+
+
+def main():
+    from backends import TorchBackend
+    from model_bundle import load_any
+
+    parser = argparse.ArgumentParser(description='Compare bf16/channels_last serving against fp32 on reference images')
+    parser.add_argument('kind', choices=['isic', 'vit'], help='isic (mole model) or vit (skin diagnosis)')
+    parser.add_argument('bundle', type=str, help='Bundle (or legacy checkpoint) to check')
+    parser.add_argument('reference', type=str, help='Folder of reference images')
+    parser.add_argument('--limit', type=int, default=256, help='Max images read from the folder')
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    model, bundle, _ = load_any(args.kind, args.bundle, device)
+
+    reference = TorchBackend(model, device)
+    bf16_model, autocast, channels_last = prepare_model(model, args.kind, "bf16")
+    candidate = TorchBackend(bf16_model, device, bf16=autocast, channels_last=channels_last)
+    drift = check_accuracy(args.kind, reference, candidate, bundle["preprocessing"], args.reference, args.limit)
+    print(json.dumps({"native_bf16": bf16_supported(), "drift": drift}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
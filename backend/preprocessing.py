@@ -0,0 +1,94 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+# CLIP statistics the ISIC model was trained with
+MOLE_IMAGE_SIZE = 256
+MOLE_MEAN = [0.4815, 0.4578, 0.4082]
+MOLE_STD = [0.2686, 0.2613, 0.2758]
+
+# google/vit-base-patch16-224-in21k processor settings
+SKIN_IMAGE_SIZE = 224
+SKIN_MEAN = [0.5, 0.5, 0.5]
+SKIN_STD = [0.5, 0.5, 0.5]
+
+
+class Preprocessor:
+    """
+    Resize + uint8->float + mean/std normalisation for one model input
+    The three per-pixel steps of ToTensor/Normalize (or ViTImageProcessor's rescale/normalize)
+    collapse into x * scale + bias, which runs as a single addcmul straight from uint8
+    Args:
+        size: Square output resolution
+        mean: Per-channel mean in [0, 1] units
+        std: Per-channel std in [0, 1] units
+    """
+
+    def __init__(self, size, mean, std):
+        self.size = size
+        mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.bias = -mean / std
+
+    def __call__(self, images):
+        """
+        Args:
+            images: A PIL image, a list of PIL images, or a uint8 tensor shaped (H, W, 3) or (N, H, W, 3)
+        Returns:
+            A float32 (3, size, size) tensor for a single image, (N, 3, size, size) otherwise
+        """
+        single = isinstance(images, Image.Image) or (torch.is_tensor(images) and images.dim() == 3)
+        if single:
+            images = [images] if isinstance(images, Image.Image) else images.unsqueeze(0)
+        batch = self._resize(images)
+        pixel_values = torch.addcmul(self.bias, batch, self.scale)
+        return pixel_values[0] if single else pixel_values
+
+    def _resize(self, images):
+        # Returns a contiguous uint8 (N, 3, size, size) tensor
+        if torch.is_tensor(images):
+            batch = images.permute(0, 3, 1, 2)
+            if batch.shape[-2:] != (self.size, self.size):
+                batch = F.interpolate(batch, size=(self.size, self.size), mode="bilinear", antialias=True, align_corners=False)
+            return batch.contiguous()
+        # PIL's bilinear resize is what both reference pipelines use, and it is cheapest on uint8
+        arrays = [
+            np.asarray(image if image.size == (self.size, self.size) else image.resize((self.size, self.size), Image.BILINEAR))
+            for image in images
+        ]
+        return torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).contiguous()
+
+
+mole_preprocessor = Preprocessor(MOLE_IMAGE_SIZE, MOLE_MEAN, MOLE_STD)
+skin_preprocessor = Preprocessor(SKIN_IMAGE_SIZE, SKIN_MEAN, SKIN_STD)
+
+
+def main():
+    # Check the fused engine against the pipelines it replaces
+    from torchvision import transforms
+    from transformers import ViTImageProcessor
+
+    mole_reference = transforms.Compose([
+        transforms.Resize((MOLE_IMAGE_SIZE, MOLE_IMAGE_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=MOLE_MEAN, std=MOLE_STD)
+    ])
+    skin_reference = ViTImageProcessor(
+        size={"height": SKIN_IMAGE_SIZE, "width": SKIN_IMAGE_SIZE},
+        image_mean=SKIN_MEAN,
+        image_std=SKIN_STD
+    )
+
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8)) for h, w in [(480, 640), (1000, 750), (224, 224)]]
+
+    mole_diff = (mole_preprocessor(images) - torch.stack([mole_reference(image) for image in images])).abs().max().item()
+    skin_diff = (skin_preprocessor(images) - skin_reference(images, return_tensors="pt")["pixel_values"]).abs().max().item()
+    print(f"Max abs difference vs torchvision Compose: {mole_diff:.2e}")
+    print(f"Max abs difference vs ViTImageProcessor:  {skin_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import json
+import logging
+import os
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from imaging import load_image
+from preprocessing import Preprocessor
+
+# "none" serves fp32; "int8" serves the quantized artefacts (or dynamic ViT quantization if none exists)
+QUANTIZE = os.environ.get("DERMO_QUANTIZE", "none")
+QUANTIZED_FORMAT = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+logger = logging.getLogger(__name__)
+
+
+def quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    engine = "x86" if "x86" in engines else "fbgemm" if "fbgemm" in engines else "qnnpack"
+    torch.backends.quantized.engine = engine
+    return engine
+
+
+def quantize_vit(model):
+    """
+    Dynamic INT8: Linear weights are quantized ahead of time, activations per batch at runtime
+    ViT-base is almost all Linear (QKV, projections, MLP), so this covers nearly every FLOP
+    """
+    quantized_engine()
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def _prepare_isic(model, example_inputs):
+    from timm.models.edgenext import PositionalEncodingFourier
+    engine = quantized_engine()
+    # The Fourier position encoding reads its conv weight's device at runtime, which breaks once
+    # that conv is quantized; it is tiny, so it stays a float leaf module
+    custom_config = PrepareCustomConfig().set_non_traceable_module_classes([PositionalEncodingFourier])
+    return prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs, prepare_custom_config=custom_config)
+
+
+def quantize_isic(model, calibration_batches):
+    """
+    Static INT8 for the conv-heavy EdgeNeXt: activation ranges come from calibration batches
+    """
+    batches = iter(calibration_batches)
+    first = next(batches)
+    prepared = _prepare_isic(model, (first,))
+    with torch.no_grad():
+        prepared(first)
+        for batch in batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def image_paths(folder):
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def folder_batches(folder, preprocessing, batch_size=16, limit=None):
+    preprocessor = Preprocessor(**preprocessing)
+    paths = image_paths(folder)[:limit]
+    if not paths:
+        raise ValueError(f"No images found under {folder}")
+    for start in range(0, len(paths), batch_size):
+        images = [load_image(path, preprocessor.size) for path in paths[start:start + batch_size]]
+        yield preprocessor(images)
+
+
+def drift_report(kind, reference, quantized, batches):
+    """
+    Compare quantized outputs with the fp32 reference on the same inputs
+    """
+    agree, total, max_diff, sum_diff = 0, 0, 0.0, 0.0
+    with torch.no_grad():
+        for batch in batches:
+            ref, out = reference(batch), quantized(batch)
+            if kind == "isic":
+                ref_probs, out_probs = torch.sigmoid(ref), torch.sigmoid(out)
+                agree += ((ref_probs > 0.5) == (out_probs > 0.5)).sum().item()
+            else:
+                ref_probs, out_probs = ref.softmax(dim=1), out.softmax(dim=1)
+                agree += (ref_probs.argmax(dim=1) == out_probs.argmax(dim=1)).sum().item()
+            diff = (ref_probs - out_probs).abs().max(dim=1).values
+            max_diff = max(max_diff, diff.max().item())
+            sum_diff += diff.sum().item()
+            total += batch.shape[0]
+    return {
+        "images": total,
+        "label_agreement": agree / total,
+        "max_prob_diff": max_diff,
+        "mean_prob_diff": sum_diff / total,
+    }
+
+
+def save_quantized(path, kind, mode, model, drift):
+    torch.save({
+        "format": QUANTIZED_FORMAT,
+        "kind": kind,
+        "mode": mode,
+        "engine": torch.backends.quantized.engine,
+        "drift": drift,
+        "state_dict": model.state_dict(),
+    }, path)
+
+
+def load_quantized(path, model, bundle):
+    """
+    Rebuild the quantized structure around an fp32 model and load the saved INT8 weights
+    Args:
+        path: Artefact written by this module
+        model: fp32 model of the same bundle (its modules are reused)
+        bundle: Bundle metadata the model was built from
+    """
+    artefact = torch.load(path, map_location="cpu", weights_only=False)
+    if artefact.get("format") != QUANTIZED_FORMAT or artefact["kind"] != bundle["kind"]:
+        raise ValueError(f"{path} is not a {bundle['kind']} quantized artefact")
+    if artefact["mode"] == "dynamic":
+        quantized = quantize_vit(model)
+    else:
+        size = bundle["preprocessing"]["size"]
+        quantized = convert_fx(_prepare_isic(model, (torch.zeros(1, 3, size, size),)))
+    quantized.load_state_dict(artefact["state_dict"])
+    return quantized.eval(), artefact
+
+
+def quantize_for_serving(model, bundle, artefact_path, device):
+    """
+    Apply the configured serving precision
+    Returns:
+        (model to serve, precision label, artefact path the INT8 weights came from or None)
+    """
+    if QUANTIZE != "int8":
+        return model, "fp32", None
+    if device.type != "cpu":
+        logger.warning("INT8 serving is CPU-only; keeping fp32 %s on %s", bundle["kind"], device)
+        return model, "fp32", None
+    if artefact_path and os.path.exists(artefact_path):
+        quantized, artefact = load_quantized(artefact_path, model, bundle)
+        logger.info("Loaded INT8 %s from %s (drift %s)", bundle["kind"], artefact_path, artefact["drift"])
+        return quantized, f"int8-{artefact['mode']}", artefact_path
+    if bundle["kind"] == "vit":
+        # Dynamic quantization needs no calibration, so it can be done at startup
+        return quantize_vit(model).eval(), "int8-dynamic", None
+    logger.warning("No calibrated INT8 artefact at %s; serving fp32 %s", artefact_path, bundle["kind"])
+    return model, "fp32", None
+
+
+def main():
+    from model_bundle import load_any
+
+    parser = argparse.ArgumentParser(description='Quantize a serving model to INT8 and report drift against fp32')
+    parser.add_argument('kind', choices=['isic', 'vit'], help='isic (static, calibrated) or vit (dynamic)')
+    parser.add_argument('bundle', type=str, help='Bundle (or legacy checkpoint) to quantize')
+    parser.add_argument('output', type=str, help='Where to write the INT8 artefact')
+    parser.add_argument('--calibration', type=str, help='Folder of images for calibration (required for isic)')
+    parser.add_argument('--eval', type=str, help='Folder of images for the drift report (defaults to --calibration)')
+    parser.add_argument('--limit', type=int, default=256, help='Max images read from each folder')
+    args = parser.parse_args()
+
+    if args.kind == 'isic' and not args.calibration:
+        parser.error('--calibration is required for static quantization of isic')
+
+    def fp32_model():
+        return load_any(args.kind, args.bundle, torch.device('cpu'))[:2]
+
+    reference, bundle = fp32_model()
+    # Quantization rewrites modules in place, so quantize a separate copy
+    model, _ = fp32_model()
+    if args.kind == 'vit':
+        quantized, mode = quantize_vit(model), 'dynamic'
+    else:
+        quantized, mode = quantize_isic(model, folder_batches(args.calibration, bundle["preprocessing"], limit=args.limit)), 'static'
+
+    eval_folder = args.eval or args.calibration
+    drift = drift_report(args.kind, reference, quantized, folder_batches(eval_folder, bundle["preprocessing"], limit=args.limit)) if eval_folder else None
+    save_quantized(args.output, args.kind, mode, quantized, drift)
+    print(json.dumps({"output": args.output, "mode": mode, "drift": drift}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_SIZE = int(os.environ.get("DERMO_RESULT_CACHE_SIZE", 2048))
+# SQLite file shared by every uvicorn worker on the host; empty disables the disk tier
+RESULT_CACHE_DB = os.environ.get("DERMO_RESULT_CACHE_DB", "")
+RESULT_CACHE_DB_ROWS = int(os.environ.get("DERMO_RESULT_CACHE_DB_ROWS", 100_000))
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(contents):
+    return hashlib.sha256(contents).hexdigest()
+
+
+def file_version(path, length=12):
+    """
+    Short content hash of a weights file, used to version cache keys
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+class _DiskTier:
+    def __init__(self, path, max_rows):
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        # WAL lets readers in other workers proceed while one worker writes
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,)
+                )
+
+
+class ResultCache:
+    """
+    Content-addressed cache of inference results
+    Keys are built by the caller from content_digest() of the upload plus model name and version
+    Args:
+        capacity: Entries kept in the in-process LRU
+        db_path: Optional SQLite file for a tier shared across workers
+        db_rows: Approximate row cap for the SQLite tier
+    """
+
+    def __init__(self, capacity=RESULT_CACHE_SIZE, db_path=RESULT_CACHE_DB, db_rows=RESULT_CACHE_DB_ROWS):
+        self.capacity = capacity
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._disk = _DiskTier(db_path, db_rows) if db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    async def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, or await compute() once and cache its result
+        Concurrent callers with the same key share a single compute()
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, key, compute):
+        loop = asyncio.get_running_loop()
+        if self._disk is not None:
+            try:
+                value = await loop.run_in_executor(None, self._disk.get, key)
+            except sqlite3.Error as exc:
+                logger.warning("Result cache read failed: %r", exc)
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        value = await compute()
+        self._remember(key, value)
+        if self._disk is not None:
+            try:
+                await loop.run_in_executor(None, self._disk.put, key, value)
+            except sqlite3.Error as exc:
+                logger.warning("Result cache write failed: %r", exc)
+        return value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "entries": len(self._memory),
+            "disk": self._disk is not None,
+        }
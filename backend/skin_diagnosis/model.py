@@ -1,13 +1,160 @@
+import json
+import os
+
+import torch
 import torch.nn as nn
-from transformers import ViTImageProcessor, ViTModel
+from transformers import ViTConfig, ViTModel
+
+from skin_diagnosis.token_merging import merge_block
+
+# Architecture of google/vit-base-patch16-224-in21k, vendored so serving never touches the hub
+VIT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vit_config.json')
+
+# class_to_idx of the ImageFolder the served weights were trained on
+class_to_idx = {
+    'Acne': 0,
+    'Actinic_Keratosis': 1,
+    'Benign_tumors': 2,
+    'Bullous': 3,
+    'Candidiasis': 4,
+    'DrugEruption': 5,
+    'Eczema': 6,
+    'Infestations_Bites': 7,
+    'Lichen': 8,
+    'Lupus': 9,
+    'Moles': 10,
+    'Psoriasis': 11,
+    'Rosacea': 12,
+    'Seborrh_Keratoses': 13,
+    'SkinCancer': 14,
+    'Sun_Sunlight_Damage': 15,
+    'Tinea': 16,
+    'Unknown_Normal': 17,
+    'Vascular_Tumors': 18,
+    'Vasculitis': 19,
+    'Vitiligo': 20,
+    'Warts': 21
+}
+
+
+def load_vit_config(config=None):
+    """
+    Build a ViTConfig from a dict, or from the vendored vit_config.json when config is None
+    """
+    if config is None:
+        with open(VIT_CONFIG_PATH) as f:
+            config = json.load(f)
+    return ViTConfig.from_dict(config)
+
+
 class ViTClassifier(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, config=None):
         super(ViTClassifier, self).__init__()
-        self.vit = ViTModel.from_pretrained('google/vit-base-patch16-224-in21k')
+        # Architecture only: the weights come from best_model.pth, so nothing is downloaded
+        self.vit = ViTModel(load_vit_config(config))
         self.classifier = nn.Linear(self.vit.config.hidden_size, num_classes)
+        # Token merging (ToMe): fraction of the patch tokens merged away per layer; 0 runs the stock ViT
+        self.merge_ratio = 0.0
 
     def forward(self, pixel_values):
-        outputs = self.vit(pixel_values=pixel_values)
-        return self.classifier(outputs.pooler_output)
+        if not self.merge_ratio:
+            outputs = self.vit(pixel_values=pixel_values)
+            return self.classifier(outputs.pooler_output)
+        hidden_states, size = self.vit.embeddings(pixel_values), None
+        for block in self._blocks():
+            hidden_states, size = self._block(block, hidden_states, size)
+        return self._final(hidden_states)
+
+    def _blocks(self):
+        # transformers 4.x keeps the encoder blocks under encoder.layer (5.x moved them to layers)
+        return self.vit.encoder.layer if hasattr(self.vit, "encoder") else self.vit.layers
+
+    def _block(self, block, hidden_states, size=None):
+        """
+        One encoder block; size counts the tokens each row stands for once tokens have been merged
+        """
+        if self.merge_ratio:
+            return merge_block(block, hidden_states, size, self.merge_ratio)
+        outputs = block(hidden_states)
+        return (outputs[0] if isinstance(outputs, tuple) else outputs), size
+
+    def _final(self, hidden_states):
+        return self.classifier(self.vit.pooler(self.vit.layernorm(hidden_states)))
+
+
+# Encoder layers (1-based) followed by an exit head; the final classifier is always the last exit
+DEFAULT_EXIT_LAYERS = [4, 6, 8, 10]
+
+
+class EarlyExitViTClassifier(ViTClassifier):
+    """
+    ViTClassifier with lightweight classifier heads on intermediate encoder layers
+    forward() still runs the full depth, so the model trains, exports and evaluates like ViTClassifier;
+    early_exit() stops each image at the first head confident enough
+    Args:
+        num_classes: Number of output classes
+        config: ViT config dict (None reads vit_config.json)
+        exit_layers: Encoder layers that get an exit head
+    """
+
+    def __init__(self, num_classes, config=None, exit_layers=DEFAULT_EXIT_LAYERS):
+        super(EarlyExitViTClassifier, self).__init__(num_classes, config)
+        hidden_size = self.vit.config.hidden_size
+        self.exit_layers = list(exit_layers)
+        self.depth = self.vit.config.num_hidden_layers
+        if any(not 0 < layer < self.depth for layer in self.exit_layers):
+            raise ValueError(f"Exit layers must lie between 1 and {self.depth - 1}, got {self.exit_layers}")
+        # Same shape as the backbone's own final LayerNorm + classifier, on the CLS token
+        self.exit_heads = nn.ModuleList(
+            nn.Sequential(nn.LayerNorm(hidden_size, eps=self.vit.config.layer_norm_eps), nn.Linear(hidden_size, num_classes))
+            for _ in self.exit_layers
+        )
+
+    def exit_logits(self, pixel_values):
+        """
+        Logits of every exit for the whole batch, intermediate heads first and the final classifier last
+        """
+        heads = dict(zip(self.exit_layers, self.exit_heads))
+        hidden_states, size = self.vit.embeddings(pixel_values), None
+        logits = []
+        for depth, block in enumerate(self._blocks(), 1):
+            hidden_states, size = self._block(block, hidden_states, size)
+            if depth in heads:
+                logits.append(heads[depth](hidden_states[:, 0]))
+        logits.append(self._final(hidden_states))
+        return logits
 
-vi_processor = ViTImageProcessor.from_pretrained('google/vit-base-patch16-224-in21k')
+    def early_exit(self, pixel_values, threshold):
+        """
+        Run each image only as deep as needed: it leaves the batch at the first exit whose
+        top softmax probability reaches threshold, and the rest continue to the next layer
+        Returns:
+            (logits, 1-based encoder layer each image exited after)
+        """
+        heads = dict(zip(self.exit_layers, self.exit_heads))
+        hidden_states, size = self.vit.embeddings(pixel_values), None
+        rows = torch.arange(pixel_values.shape[0])
+        exits = torch.full_like(rows, self.depth)
+        logits = None
+        for depth, block in enumerate(self._blocks(), 1):
+            hidden_states, size = self._block(block, hidden_states, size)
+            if depth not in heads:
+                continue
+            head_logits = heads[depth](hidden_states[:, 0])
+            done = (head_logits.float().softmax(dim=1).amax(dim=1) >= threshold).cpu()
+            if not done.any():
+                continue
+            if logits is None:
+                logits = head_logits.new_empty(len(exits), head_logits.shape[1])
+            logits[rows[done]] = head_logits[done]
+            exits[rows[done]] = depth
+            keep = ~done.to(hidden_states.device)
+            rows, hidden_states = rows[~done], hidden_states[keep]
+            size = None if size is None else size[keep]
+            if not len(rows):
+                return logits, exits
+        final = self._final(hidden_states)
+        if logits is None:
+            return final, exits
+        logits[rows] = final.to(logits.dtype)
+        return logits, exits
@@ -0,0 +1,91 @@
+import math
+import os
+
+import torch
+import torch.nn.functional as F
+
+# Fraction of the patch tokens merged away in every encoder layer (0 runs the stock ViT)
+TOKEN_MERGE_RATIO = float(os.environ.get("DERMO_TOKEN_MERGE_RATIO", 0))
+
+
+def bipartite_soft_matching(metric, r):
+    """
+    ToMe matching (Bolya et al., "Token Merging: Your ViT But Faster"): split the tokens into two
+    alternating sets and pair each token of the first set with its most similar token in the second;
+    the r most similar pairs are merged. The CLS token (index 0) is never merged and stays first
+    Args:
+        metric: (B, N, C) per-token similarity features (attention keys averaged over heads)
+        r: Tokens to remove
+    Returns:
+        merge(x): reduces any (B, N, C') tensor to (B, N - r, C') by summing merged tokens
+    """
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[:, ::2], metric[:, 1::2]
+        scores = a @ b.transpose(-1, -2)
+        scores[:, 0, :] = -math.inf
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        # Sorting the kept tokens keeps CLS at the front
+        unmerged_idx = edge_idx[:, r:].sort(dim=1).values
+        src_idx = edge_idx[:, :r]
+        dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+
+    def merge(x):
+        src, dst = x[:, ::2], x[:, 1::2]
+        batch, tokens, channels = src.shape
+        unmerged = src.gather(dim=1, index=unmerged_idx.expand(batch, tokens - r, channels))
+        src = src.gather(dim=1, index=src_idx.expand(batch, r, channels))
+        dst = dst.scatter_reduce(1, dst_idx.expand(batch, r, channels), src, reduce="sum")
+        return torch.cat([unmerged, dst], dim=1)
+
+    return merge
+
+
+def _attention(block, hidden_states, size):
+    """
+    Self-attention of a transformers ViTLayer, with ToMe's proportional attention: a merged token
+    gets the attention weight of all the tokens it stands for
+    Returns:
+        (attention output, keys averaged over heads)
+    """
+    self_attention = block.attention.attention
+    batch, tokens, _ = hidden_states.shape
+    heads, head_size = self_attention.num_attention_heads, self_attention.attention_head_size
+
+    def split(layer):
+        return layer(hidden_states).view(batch, tokens, heads, head_size).transpose(1, 2)
+
+    query, key, value = split(self_attention.query), split(self_attention.key), split(self_attention.value)
+    bias = None if size is None else size.log()[:, None, None, :, 0].to(query.dtype)
+    context = F.scaled_dot_product_attention(query, key, value, attn_mask=bias)
+    context = context.transpose(1, 2).reshape(batch, tokens, heads * head_size)
+    return block.attention.output.dense(context), key.mean(dim=1)
+
+
+def merge_block(block, hidden_states, size, ratio):
+    """
+    One ViTLayer with token merging between attention and MLP, using the layer's own weights
+    Args:
+        block: transformers ViTLayer
+        hidden_states: (B, N, C) tokens, CLS first
+        size: (B, N, 1) tokens each row stands for (None before the first merge)
+        ratio: Fraction of the patch tokens to merge away
+    Returns:
+        (hidden states, size) with fewer tokens
+    """
+    attention, metric = _attention(block, block.layernorm_before(hidden_states), size)
+    hidden_states = hidden_states + attention
+    tokens = hidden_states.shape[1]
+    r = min(int(ratio * (tokens - 1)), (tokens - 1) // 2)
+    if r > 0:
+        if size is None:
+            size = hidden_states.new_ones(hidden_states.shape[0], tokens, 1)
+        merge = bipartite_soft_matching(metric, r)
+        # Size-weighted average of the merged tokens
+        hidden_states = merge(hidden_states * size)
+        size = merge(size)
+        hidden_states = hidden_states / size
+    # ViTOutput adds the residual itself
+    hidden_states = block.output(block.intermediate(block.layernorm_after(hidden_states)), hidden_states)
+    return hidden_states, size
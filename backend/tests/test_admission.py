@@ -0,0 +1,45 @@
+import asyncio
+
+from admission import Gate, Rejected
+
+
+def test_gate_bounds_a_same_tick_burst():
+    gate = Gate(limit=1, queue_size=1, timeout=5)
+    peak_waiting = 0
+
+    async def request():
+        nonlocal peak_waiting
+        try:
+            await gate.acquire()
+        except Rejected:
+            return False
+        peak_waiting = max(peak_waiting, gate.waiting)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            gate.release()
+        return True
+
+    async def burst():
+        return await asyncio.gather(*(request() for _ in range(6)))
+
+    admitted = asyncio.run(burst())
+    assert admitted.count(True) == 2
+    assert gate.rejected == 4
+    assert peak_waiting <= 1
+    assert gate.active == 0 and gate.waiting == 0
+
+
+def test_gate_unbounded_queue_admits_everyone():
+    gate = Gate(limit=1, queue_size=0, timeout=5)
+
+    async def request():
+        await gate.acquire()
+        await asyncio.sleep(0)
+        gate.release()
+
+    async def burst():
+        await asyncio.gather(*(request() for _ in range(6)))
+
+    asyncio.run(burst())
+    assert gate.rejected == 0
@@ -0,0 +1,38 @@
+import json
+from collections import defaultdict
+
+from groq import SectionStreamParser
+
+ADVICE = json.dumps({
+    "Info": "Eczema is \"atopic\" dermatitis \\ a chronic\ncondition é — common in children.",
+    "At-Home Treatment": ["Wash gently", "Use sunscreen", {"note": "pat dry , not rub"}],
+    "Clinical Treatment": {"options": ["topical steroids", "calcineurin inhibitors"], "visits": 2},
+    "Severity": "Moderate: see a clinician if it spreads.",
+}, indent=2, ensure_ascii=False)
+
+
+def parse(chunks):
+    parser = SectionStreamParser()
+    sections = defaultdict(str)
+    for chunk in chunks:
+        for section, text in parser.feed(chunk):
+            sections[section] += text
+    return dict(sections)
+
+
+def test_single_chunk_parse():
+    sections = parse([ADVICE])
+    assert sections["Info"] == json.loads(ADVICE)["Info"]
+    assert json.loads(sections["At-Home Treatment"]) == json.loads(ADVICE)["At-Home Treatment"]
+    assert json.loads(sections["Clinical Treatment"]) == json.loads(ADVICE)["Clinical Treatment"]
+
+
+def test_every_split_matches_the_single_chunk_parse():
+    expected = parse([ADVICE])
+    for offset in range(1, len(ADVICE)):
+        assert parse([ADVICE[:offset], ADVICE[offset:]]) == expected, offset
+
+
+def test_raw_value_keeps_inner_whitespace_across_chunks():
+    sections = parse(['{"At-Home Treatment": ["Wash gently",', ' "Use sunscreen"], "Severity": "Low"}'])
+    assert sections["At-Home Treatment"] == '["Wash gently", "Use sunscreen"]'
@@ -0,0 +1,50 @@
+import pytest
+import torch
+
+from model_bundle import BUNDLE_FORMAT, build_model, default_bundle, load_any, load_model, save_bundle
+
+
+def student_bundle(model_name):
+    # What distill.py writes for a timm student
+    bundle = default_bundle("vit")
+    bundle["config"] = {"model_name": model_name, "num_classes": len(bundle["classes"])}
+    return bundle
+
+
+BUNDLES = {
+    "isic-edgenext": lambda: default_bundle("isic"),
+    "vit": lambda: default_bundle("vit"),
+    "student-deit-tiny": lambda: student_bundle("deit_tiny_patch16_224"),
+}
+
+
+@pytest.mark.parametrize("name", sorted(BUNDLES))
+def test_bundle_round_trip(name, tmp_path):
+    bundle = BUNDLES[name]()
+    assert bundle["format"] == BUNDLE_FORMAT
+    torch.manual_seed(0)
+    model = build_model(bundle).eval()
+    path = str(tmp_path / "bundle.safetensors")
+    save_bundle(path, bundle, model.state_dict())
+
+    loaded, loaded_bundle, source = load_model(bundle["kind"], [path], None, torch.device("cpu"))
+    assert source == path
+    assert loaded_bundle.get("classes") == bundle.get("classes")
+    size = bundle["preprocessing"]["size"]
+    batch = torch.randn(2, 3, size, size)
+    with torch.no_grad():
+        assert torch.allclose(loaded(batch), model(batch), atol=1e-5)
+
+
+def test_load_any_takes_a_bundle_or_a_legacy_checkpoint(tmp_path):
+    bundle = default_bundle("isic")
+    model = build_model(bundle).eval()
+    bundle_path, checkpoint_path = str(tmp_path / "isic.safetensors"), str(tmp_path / "isic.pt")
+    save_bundle(bundle_path, bundle, model.state_dict())
+    torch.save(model.state_dict(), checkpoint_path)
+
+    for path in (bundle_path, checkpoint_path):
+        loaded, _, source = load_any("isic", path, torch.device("cpu"))
+        assert source == path
+        for name, tensor in model.state_dict().items():
+            assert torch.equal(loaded.state_dict()[name], tensor)
@@ -2,16 +2,18 @@ import torch
 import torch.nn as nn
 from torchvision.datasets import ImageFolder
 from torch.utils.data import DataLoader
-from transformers import ViTImageProcessor, ViTModel
+from transformers import ViTModel
 from sklearn.metrics import classification_report, accuracy_score
 from tqdm import tqdm
 import torch.backends.cudnn as cudnn
 from transformers import get_linear_schedule_with_warmup
 from functools import partial
+from imaging import load_image
+from preprocessing import SKIN_IMAGE_SIZE, skin_preprocessor
 
 def collate_fn(batch, processor):
     images, labels = zip(*batch)
-    pixel_values = processor(images, return_tensors="pt")["pixel_values"]
+    pixel_values = processor(list(images))
     labels = torch.tensor(labels)
     return pixel_values, labels
 
@@ -27,12 +29,12 @@ def main():
     EPOCHS = 50
     LR = 2e-5
 
-    processor = ViTImageProcessor.from_pretrained(MODEL_NAME)
+    collate = partial(collate_fn, processor=skin_preprocessor)
 
-    collate = partial(collate_fn, processor=processor)
-
-    train_dataset = ImageFolder('data/SkinDisease/train')
-    test_dataset = ImageFolder('data/SkinDisease/test')
+    # Decode straight to (roughly) the resolution the preprocessor resizes to
+    loader = partial(load_image, target_size=SKIN_IMAGE_SIZE)
+    train_dataset = ImageFolder('data/SkinDisease/train', loader=loader)
+    test_dataset = ImageFolder('data/SkinDisease/test', loader=loader)
 
     train_loader = DataLoader(
         train_dataset, 
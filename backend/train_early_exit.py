@@ -0,0 +1,177 @@
+import argparse
+import json
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision.datasets import ImageFolder
+from torch.utils.data import DataLoader
+from sklearn.metrics import accuracy_score
+from tqdm import tqdm
+from transformers import get_linear_schedule_with_warmup
+from functools import partial
+from imaging import load_image
+from model_bundle import load_any, load_model, save_bundle
+from preprocessing import Preprocessor
+from skin_diagnosis.model import DEFAULT_EXIT_LAYERS, EarlyExitViTClassifier
+from train import collate_fn
+
+
+def exit_loss(exit_logits, labels, criterion, temperature):
+    """
+    Cross-entropy on the labels for every intermediate head, plus distillation towards the
+    final classifier so the heads agree with what full-depth inference would have said
+    """
+    final = exit_logits[-1].detach()
+    soft_targets = F.softmax(final / temperature, dim=1)
+    loss = 0
+    for logits in exit_logits[:-1]:
+        distill = F.kl_div(F.log_softmax(logits / temperature, dim=1), soft_targets, reduction="batchmean")
+        loss = loss + criterion(logits, labels) + distill * temperature ** 2
+    return loss / (len(exit_logits) - 1)
+
+
+def evaluate_exits(model, loader, device, thresholds):
+    """
+    Accuracy of every exit, and the accuracy / mean exit layer early exit would give at each threshold
+    """
+    model.eval()
+    probs, all_labels = None, []
+    with torch.no_grad():
+        for pixel_values, labels in tqdm(loader, desc="Testing", leave=False):
+            batch = [logits.float().softmax(dim=1).cpu() for logits in model.exit_logits(pixel_values.to(device))]
+            probs = batch if probs is None else [torch.cat([seen, new]) for seen, new in zip(probs, batch)]
+            all_labels.extend(labels.numpy())
+    labels = np.array(all_labels)
+    layers = model.exit_layers + [model.depth]
+    report = {"exits": {str(layer): accuracy_score(labels, p.argmax(dim=1).numpy()) for layer, p in zip(layers, probs)}}
+    report["thresholds"] = {}
+    for threshold in thresholds:
+        # Simulate early_exit(): each image takes the first exit confident enough, else the final one
+        preds = probs[-1].argmax(dim=1).clone()
+        exits = torch.full((len(labels),), model.depth)
+        pending = torch.ones(len(labels), dtype=torch.bool)
+        for layer, p in zip(model.exit_layers, probs):
+            take = pending & (p.max(dim=1).values >= threshold)
+            preds[take], exits[take] = p.argmax(dim=1)[take], layer
+            pending &= ~take
+        report["thresholds"][str(threshold)] = {
+            "accuracy": accuracy_score(labels, preds.numpy()),
+            "mean_exit_layer": exits.float().mean().item(),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train early-exit heads on top of a trained skin diagnosis ViT')
+    parser.add_argument('bundle', type=str, help='ViT bundle (or legacy checkpoint) to add exits to')
+    parser.add_argument('output', type=str, help='Where to write the early-exit bundle (.safetensors or .pt)')
+    parser.add_argument('--data', type=str, default='data/SkinDisease', help='ImageFolder root with train/ and test/')
+    parser.add_argument('--exit-layers', type=int, nargs='+', default=DEFAULT_EXIT_LAYERS)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--temperature', type=float, default=2.0, help='Distillation temperature towards the final head')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95])
+    args = parser.parse_args()
+
+    DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    backbone, bundle, _ = load_any('vit', args.bundle, DEVICE)
+    bundle["exit_layers"] = args.exit_layers
+
+    # The trained backbone and final classifier are reused as-is; only the new heads learn
+    model = EarlyExitViTClassifier(len(bundle["classes"]), config=bundle["config"], exit_layers=args.exit_layers)
+    missing, unexpected = model.load_state_dict(backbone.state_dict(), strict=False)
+    assert not unexpected and all(key.startswith("exit_heads.") for key in missing), (missing, unexpected)
+    model.to(DEVICE)
+    for name, parameter in model.named_parameters():
+        parameter.requires_grad = name.startswith("exit_heads.")
+
+    preprocessor = Preprocessor(**bundle["preprocessing"])
+    collate = partial(collate_fn, processor=preprocessor)
+    loader = partial(load_image, target_size=preprocessor.size)
+    train_dataset = ImageFolder(f'{args.data}/train', loader=loader)
+    test_dataset = ImageFolder(f'{args.data}/test', loader=loader)
+    if train_dataset.classes != bundle["classes"]:
+        raise ValueError(f"{args.data} classes do not match the bundle's")
+
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, collate_fn=collate,
+                              pin_memory=True, num_workers=4)
+    test_loader = DataLoader(test_dataset, batch_size=args.batch_size, shuffle=False, collate_fn=collate,
+                             pin_memory=True, num_workers=4)
+
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(model.exit_heads.parameters(), lr=args.lr)
+    num_training_steps = len(train_loader) * args.epochs
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer,
+        num_warmup_steps=int(0.1 * num_training_steps),
+        num_training_steps=num_training_steps
+    )
+
+    use_amp = DEVICE.type == 'cuda'
+    scaler = torch.amp.GradScaler('cuda', enabled=use_amp)
+    best_val_loss = float('inf')
+    temperance = 2
+    count = 0
+
+    for epoch in range(args.epochs):
+        print(f"\nEpoch {epoch+1}/{args.epochs}")
+        # The frozen backbone stays in eval mode; only the heads train
+        model.eval()
+        model.exit_heads.train()
+        total_loss = 0
+        train_loop = tqdm(train_loader, desc="Training", leave=False)
+
+        for pixel_values, labels in train_loop:
+            pixel_values, labels = pixel_values.to(DEVICE), labels.to(DEVICE)
+
+            optimizer.zero_grad()
+            with torch.amp.autocast(DEVICE.type, enabled=use_amp):
+                loss = exit_loss(model.exit_logits(pixel_values), labels, criterion, args.temperature)
+
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            scheduler.step()
+
+            total_loss += loss.item()
+            train_loop.set_postfix(loss=loss.item())
+
+        avg_train_loss = total_loss / len(train_loader)
+        print(f"Train Loss: {avg_train_loss:.4f}")
+
+        # Validation
+        model.eval()
+        val_loss = 0
+        with torch.no_grad(), torch.amp.autocast(DEVICE.type, enabled=use_amp):
+            for pixel_values, labels in tqdm(test_loader, desc="Validating", leave=False):
+                pixel_values, labels = pixel_values.to(DEVICE), labels.to(DEVICE)
+                val_loss += exit_loss(model.exit_logits(pixel_values), labels, criterion, args.temperature).item()
+
+        avg_val_loss = val_loss / len(test_loader)
+        print(f"Val Loss: {avg_val_loss:.4f}")
+
+        # Save best heads
+        if avg_val_loss < best_val_loss:
+            best_val_loss = avg_val_loss
+            save_bundle(args.output, bundle, model.state_dict())
+            print("Bundle Saved (best so far)")
+            count = 0
+        else:
+            count += 1
+            print(f"No improvement for {count} epochs.")
+            if count >= temperance:
+                print("Early stopping triggered.")
+                break
+
+    print("\nLoading best bundle for final evaluation...")
+    model, _, _ = load_model('vit', [args.output], None, DEVICE)
+    report = evaluate_exits(model, test_loader, DEVICE, args.thresholds)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
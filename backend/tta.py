@@ -0,0 +1,49 @@
+import os
+
+import torch
+import torch.nn.functional as F
+
+# "off": augmented views only when a request asks (?tta=true); "auto": also when the first pass is uncertain
+TTA = os.environ.get("DERMO_TTA", "off")
+# Mole probabilities inside this band get a second, augmented pass in auto mode
+TTA_BAND = tuple(float(bound) for bound in os.environ.get("DERMO_TTA_BAND", "0.35,0.65").split(","))
+# Skin diagnoses whose top probability is below this get a second, augmented pass in auto mode
+TTA_MIN_CONFIDENCE = float(os.environ.get("DERMO_TTA_MIN_CONFIDENCE", 0.5))
+# Centre crops (fraction of the side) resized back to full resolution, on top of the flips and rotations
+TTA_SCALES = [float(scale) for scale in os.environ.get("DERMO_TTA_SCALES", "0.9,0.8").split(",") if scale]
+
+
+def augmented_views(tensor, scales=TTA_SCALES):
+    """
+    Stack the augmented views of one preprocessed image into a single batch
+    Views: identity, horizontal and vertical flips, 90/180/270 degree rotations, then one centre crop per scale
+    Args:
+        tensor: Normalised (3, size, size) input
+        scales: Centre-crop fractions
+    Returns:
+        (views, 3, size, size) tensor
+    """
+    views = [
+        tensor,
+        tensor.flip(-1),
+        tensor.flip(-2),
+        tensor.rot90(1, (-2, -1)),
+        tensor.rot90(2, (-2, -1)),
+        tensor.rot90(3, (-2, -1)),
+    ]
+    size = tensor.shape[-1]
+    for scale in scales:
+        crop = max(1, round(size * scale))
+        offset = (size - crop) // 2
+        patch = tensor[:, offset:offset + crop, offset:offset + crop].unsqueeze(0)
+        views.append(F.interpolate(patch, size=(size, size), mode="bilinear", align_corners=False)[0])
+    return torch.stack(views)
+
+
+def mole_uncertain(probability):
+    low, high = TTA_BAND
+    return TTA == "auto" and low <= probability <= high
+
+
+def skin_uncertain(confidence):
+    return TTA == "auto" and confidence < TTA_MIN_CONFIDENCE